@@ -0,0 +1,80 @@
+"""Per-month counts of requests for the reports.
+
+Every month keeps how many requests there are by state, by department and
+state, and by user and department. The counts are updated as requests are
+created and change state, so a report adds up a few months of counts
+instead of going through every request ever made.
+
+A rollup is a plain dict::
+
+    {'states': {state: count},
+     'departments': {department: {state: count}},
+     'users': {user_email: {department: count}}}
+"""
+
+
+def month_of(request):
+    """Return the ``YYYYMM`` month a request was submitted in."""
+    return request['timestamp'][:6]
+
+
+def empty_rollup():
+    return {'states': {}, 'departments': {}, 'users': {}}
+
+
+def add_count(rollup, department, user_email, state, count=1):
+    """Add ``count`` requests of ``user_email`` in ``department`` and ``state`` to ``rollup``."""
+    rollup['states'][state] = rollup['states'].get(state, 0) + count
+    states = rollup['departments'].setdefault(department, {})
+    states[state] = states.get(state, 0) + count
+    departments = rollup['users'].setdefault(user_email, {})
+    departments[department] = departments.get(department, 0) + count
+
+
+def in_period(month, year=None, month_number=None):
+    """Whether the ``YYYYMM`` ``month`` is in ``year`` and is ``month_number`` (either may be None)."""
+    return (year is None or month[:4] == f"{year:04d}") and \
+        (month_number is None or month[4:] == f"{month_number:02d}")
+
+
+class MonthlyAggregates:
+    """The monthly rollups of a set of requests, kept up to date by the request index."""
+
+    def __init__(self):
+        self.months = {}  # YYYYMM -> {(department, user_email, state): count}
+
+    def add(self, request):
+        self._count(request, request['state'], 1)
+
+    def change_state(self, request, state):
+        """Account for ``request`` moving from its current state to ``state``."""
+        if request['state'] != state:
+            self._count(request, request['state'], -1)
+            self._count(request, state, 1)
+
+    def _count(self, request, state, count):
+        counts = self.months.setdefault(month_of(request), {})
+        key = (request.get('department') or "", request.get('user_email') or "", state)
+        counts[key] = counts.get(key, 0) + count
+
+    def set_month(self, month, rows):
+        """Replace the counts of ``month`` with ``rows``, as returned by ``count_rows``."""
+        self.months[month] = {tuple(row[:3]): row[3] for row in rows}
+
+    def rollup(self, year=None, month=None):
+        """Return the rollup of the months in ``year`` and ``month`` (every month by default)."""
+        rollup = empty_rollup()
+        for month_key, counts in self.months.items():
+            if in_period(month_key, year, month):
+                for (department, user_email, state), count in counts.items():
+                    if count:
+                        add_count(rollup, department, user_email, state, count)
+        return rollup
+
+
+def count_rows(requests):
+    """Return the counts of ``requests`` as sorted ``[department, user_email, state, count]`` rows."""
+    aggregates = MonthlyAggregates()
+    for request in requests:
+        aggregates.add(request)
+    return sorted([*key, count] for counts in aggregates.months.values() for key, count in counts.items() if count)
@@ -0,0 +1,60 @@
+"""Content-addressed attachments.
+
+An attachment is stored once, under a name derived from the sha256 of its
+bytes, so the same flyer sent with several requests is uploaded and kept
+only once. Every request lists the paths it uses; a stored attachment is
+deleted only when the last request listing it is cleaned up.
+
+An image may come with derived files that aren't listed in the request but
+share its name: a thumbnail and the original as uploaded.
+"""
+import hashlib
+import os
+
+ATTACHMENTS_DIR = "data/attachments"  # Where attachments live in the GitHub repo
+CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing
+
+
+class UploadError(Exception):
+    """Some attachments couldn't be read, stored or uploaded; ``failures`` maps their local path to the error."""
+
+    def __init__(self, failures):
+        super().__init__(f"Failed to save {len(failures)} attachments: " +
+                         "; ".join(f"{os.path.basename(path)}: {error}" for path, error in failures.items()))
+        self.failures = failures
+
+
+def new_hashes(size):
+    """Return a sha256 and a git blob sha of ``size`` bytes, to be updated with the same chunks."""
+    return hashlib.sha256(), hashlib.sha1(f"blob {size}\0".encode())
+
+
+def hash_file(path):
+    """Return the sha256 and the git blob sha of a local file, reading it once in chunks."""
+    sha256, git_sha = new_hashes(os.path.getsize(path))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            git_sha.update(chunk)
+    return sha256.hexdigest(), git_sha.hexdigest()
+
+
+def content_name(digest, name):
+    """Return the file name of an attachment: its digest plus the extension of ``name``."""
+    return digest + os.path.splitext(name)[1].lower()
+
+
+def thumbnail_path(path):
+    """Return where the thumbnail of the image at ``path`` is kept."""
+    return os.path.splitext(path)[0] + ".thumb.jpg"
+
+
+def original_path(path):
+    """Return where the image at ``path`` is kept as uploaded, before being optimized."""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.original{extension}"
+
+
+def derived_paths(path):
+    """Return the paths of every file derived from the attachment at ``path``."""
+    return [thumbnail_path(path), original_path(path)]
@@ -1,106 +1,590 @@
+import base64
 import datetime
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pytz
-from github import Github
+from github import GithubException, InputGitTreeElement, UnknownObjectException
 import streamlit as st
 import json
 
-GITHUB_TOKEN = st.secrets["github_token"]  # Use Streamlit secrets in production
-REPO_NAME = "karendcl/fbio-web-requests"  # Your repo
-FILE_PATH = "data.json"  # Path to your JSON file
+import attachment_store
+import eventlog
+import github_client
+import partitions
+import states
+import telemetry
+from aggregates import month_of
+from attachment_store import UploadError
+from datacache import DataCache
+
+FILE_PATH = "data.json"  # Where every request was kept before the monthly partitions, read until the first compaction
+EVENTS_PATH = "events.jsonl"  # Append-only log of changes not yet folded into the partitions
+COMPACT_EVERY = int(st.secrets.get("compact_every", 200))  # Events in the log that trigger a compaction
+CACHE_TTL = float(st.secrets.get("cache_ttl", 30))  # Seconds the requests are served from memory before revalidating
 BRANCH = "main"  # Branch to update
+CONFLICT_RETRIES = 5  # Times a commit is retried when the branch moved underneath it
+CONFLICT_BACKOFF = 0.5  # Seconds before the first retry, doubled every time
+UPLOAD_WORKERS = int(st.secrets.get("upload_workers", 4))  # Attachments uploaded at once
+UPLOAD_RETRIES = 3  # Times a failed attachment upload is retried
+DOWNLOAD_WORKERS = int(st.secrets.get("download_workers", 4))  # Partitions downloaded at once
+PERIOD_KEY = "data.json:period"  # Cache entry of the requests of only some months
+EVERY_MONTH = ("000000", "999999")  # Periods are (first, last) months, both YYYYMM and included
+NO_MONTH = ("999999", "000000")  # Empty period, for the counts and the version of the data
 
 
-def update_json(new_data):
-    """Update JSON file on GitHub with new data and upload images"""
-    g = Github(GITHUB_TOKEN)
-    repo = g.get_repo(REPO_NAME)
+cache = DataCache(CACHE_TTL)
+_uploaded = set()  # Blob shas uploaded but maybe not committed yet, e.g. with a batch that failed
+_manifest = (None, {})  # (blob sha, parsed manifest)
+_parsed = {}  # blob sha -> requests of a partition (or data.json), kept while the data still uses it
 
-    try:
-        # Get current JSON file
-        file = repo.get_contents(FILE_PATH, ref=BRANCH)
-        sha = file.sha
-        current_data = json.loads(file.decoded_content.decode())
-    except:
-        # File doesn't exist yet
-        sha = None
-        current_data = []
-
-    print("Current data:", current_data)
-    print("New data:", new_data)
-
-    # Handle image uploads
-    uploaded_image_paths = []
-    for img_path in new_data['images']:
+
+def get_head_sha():
+    """Return the sha of the commit the branch points to."""
+    return github_client.conditional_get(github_client.repo_api_url(f"git/ref/heads/{BRANCH}"))['object']['sha']
+
+
+def read_blob_bytes(repo, sha):
+    content = base64.b64decode(repo.get_git_blob(sha).content)
+    telemetry.count("github_bytes_received", len(content))
+    return content
+
+
+def read_blob(repo, sha):
+    return read_blob_bytes(repo, sha).decode()
+
+
+def read_partition(repo, sha, path):
+    """Return the requests of the partition (or data.json) blob ``sha``, parsed only the first time."""
+    requests = _parsed.get(sha)
+    if requests is None:
+        requests = _parsed[sha] = partitions.decode(read_blob_bytes(repo, sha), path)
+    return requests
+
+
+def _download_partition(sha, path, priority):
+    with github_client.api_call(priority=priority, name="load_partition") as repo:
+        return read_partition(repo, sha, path)
+
+
+def read_partitions(blobs):
+    """Return the requests of every partition in ``blobs`` (``{blob sha: path}``), in that order.
+
+    Partitions parsed before are not downloaded again; the others are
+    downloaded ``DOWNLOAD_WORKERS`` at a time.
+    """
+    missing = [(sha, path) for sha, path in blobs.items() if sha not in _parsed]
+    if missing:
+        # Worker threads don't inherit the priority of this one
+        priority = github_client.current_priority()
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="download") as pool:
+            for future in [pool.submit(_download_partition, sha, path, priority) for sha, path in missing]:
+                future.result()
+    return [request for sha in blobs for request in _parsed[sha]]
+
+
+def load_requests_at(head_sha, period=EVERY_MONTH):
+    """Load the partitions and the event log at ``head_sha`` and fold them together.
+
+    Partitions only change on compaction, so they are kept parsed by blob
+    sha and only the ones that changed since the last load are downloaded.
+    Only the partitions of the months in ``period`` (``(first, last)``, both
+    ``YYYYMM`` and included) are loaded, plus those of the requests the
+    event log touches; the counts of the other months come from the manifest.
+    """
+    global _manifest, _parsed
+    with github_client.api_call(cost=3, name="load_data") as repo:
+        tree = [element for element in repo.get_git_tree(head_sha, recursive=True).tree if element.type == "blob"]
+        blob_shas = {element.path: element.sha for element in tree}
+
+        events_sha = blob_shas.get(EVENTS_PATH)
+        events = eventlog.loads(read_blob(repo, events_sha)) if events_sha else []
+
+        snapshot_sha = blob_shas.get(partitions.MANIFEST_PATH)
+        if snapshot_sha:
+            if _manifest[0] != snapshot_sha:
+                _manifest = (snapshot_sha, json.loads(read_blob(repo, snapshot_sha)))
+            manifest = _manifest[1]
+            # Manifests written before the counts were kept don't have them
+            months = {month for month, entry in manifest.items()
+                      if _in_period(month, period) or 'counts' not in entry}
+            if months != manifest.keys():
+                months |= event_months(repo, manifest, events)
+            blobs = {entry['sha']: entry['path'] for month, entry in sorted(manifest.items()) if month in months}
+            used = {entry['sha'] for entry in manifest.values()}
+        else:
+            # Not split into partitions yet, that happens on the next compaction
+            manifest, months = {}, set()
+            snapshot_sha = blob_shas.get(FILE_PATH)
+            blobs = {snapshot_sha: FILE_PATH} if snapshot_sha else {}
+            used = set(blobs)
+            period = EVERY_MONTH
+    # Partitions the data no longer uses won't be needed again
+    _parsed = {sha: requests for sha, requests in _parsed.items() if sha in used}
+    snapshot = read_partitions(blobs)
+    with telemetry.span("data.replay"):
+        index = eventlog.replay([dict(request) for request in snapshot], events)
+    for month in manifest.keys() - months:
+        index.aggregates.set_month(month, manifest[month]['counts'])
+    index.files = {element.path: element.size for element in tree}
+    index.version = f"{snapshot_sha}:{events_sha}"
+    index.period = period
+    return index
+
+
+def _in_period(month, period):
+    first, last = period
+    return first <= month <= last
+
+
+def _covers(period, other):
+    """Whether every month of ``other`` is in ``period``."""
+    return other[0] > other[1] or period[0] <= other[0] and other[1] <= period[1]
+
+
+def get_index(period=EVERY_MONTH):
+    """Get the current requests as a :class:`RequestIndex`, from the same cache as ``get_json``.
+
+    With a ``period`` (see ``load_requests_at``) the index may only hold the
+    requests of those months. Such indexes share one cache entry, which grows
+    to the months asked for until the data changes.
+    """
+    if period == EVERY_MONTH:
+        return cache.get(FILE_PATH, get_head_sha, load_requests_at)
+    index = cache.get(PERIOD_KEY, get_head_sha, lambda head_sha: load_requests_at(head_sha, period))
+    if not _covers(index.period, period):
+        if index.period[0] <= index.period[1]:
+            period = (min(period[0], index.period[0]), max(period[1], index.period[1]))
+        cache.invalidate(PERIOD_KEY)
+        index = cache.get(PERIOD_KEY, get_head_sha, lambda head_sha: load_requests_at(head_sha, period))
+    return index
+
+
+def get_index_at_head():
+    """Return the sha of the branch head and the requests at it, checking the head now instead of after the TTL."""
+    head_sha = get_head_sha()
+    return head_sha, cache.get(FILE_PATH, lambda: head_sha, load_requests_at, revalidate=True)
+
+
+def get_json():
+    """Get the current requests: the partitions with the event log folded in.
+
+    The result is cached for ``CACHE_TTL`` seconds and then revalidated
+    against the branch head; it is shared, so don't modify it.
+    """
+    return get_index().requests
+
+
+def name_attachments(paths, kind, attachments, progress=None, digests=None):
+    """Find the content-addressed GitHub path of every local attachment.
+
+    Adds ``{github_path: (local_path, blob_sha)}`` to ``attachments``; the
+    files are only hashed, not uploaded, and not even that if ``digests``
+    has their ``(sha256, blob_sha)``. ``kind`` is either ``"image"`` or
+    ``"file"``. Returns the GitHub paths of the attachments. Those that
+    can't be read are reported to ``progress`` (see ``upload_files``) and
+    raise :class:`UploadError` once all were tried, so the request isn't
+    saved without them.
+    """
+    github_paths = []
+    failures = {}
+    for local_path in paths:
         try:
-            # Read the image file
-            img_name1 = img_path[5:]
-            with open(img_path, 'rb') as img_file:
-                img_content = img_file.read()
-
-            # Create filename with timestamp to avoid conflicts
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            img_name = f"image_{timestamp}_{img_name1}"
-            github_img_path = f"data/{img_name}"
-
-            # Upload to GitHub
-            repo.create_file(
-                path=github_img_path,
-                message=f"Add image {img_name}",
-                content=img_content,
-                branch=BRANCH
-            )
-            uploaded_image_paths.append(github_img_path)
-        except Exception as e:
-            print(f"Failed to upload image {img_path}: {str(e)}")
+            digest, blob_sha = (digests or {}).get(local_path) or attachment_store.hash_file(local_path)
+        except OSError as e:
+            print(f"Failed to read {kind} {local_path}: {str(e)}")
+            error = failures[local_path] = f"Can't read the file: {e.strerror}"
+            if progress:
+                progress(local_path, error)
+            continue
+        github_path = f"{attachment_store.ATTACHMENTS_DIR}/{attachment_store.content_name(digest, local_path)}"
+        attachments[github_path] = (local_path, blob_sha)
+        github_paths.append(github_path)
+
+        # Thumbnails and originals go along, unless the attachment (and so they) is stored already
+        if github_path not in get_index().references:
+            for local_derived, github_derived in zip(attachment_store.derived_paths(local_path),
+                                                     attachment_store.derived_paths(github_path)):
+                if not os.path.isfile(local_derived):
+                    continue
+                try:
+                    attachments[github_derived] = (local_derived, attachment_store.hash_file(local_derived)[1])
+                except OSError as e:
+                    # The attachment itself is fine, only its thumbnail or original is missing
+                    print(f"Failed to read {local_derived}, saving {local_path} without it: {str(e)}")
+
+    if failures:
+        raise UploadError(failures)
+    return github_paths
+
+
+def upload_attachments(attachments, progress=None):
+    """Upload the attachments named by ``name_attachments`` and return ``{github_path: blob_sha}``.
+
+    Attachments some request already lists are in the repo, and those
+    uploaded for a commit that failed are still there, so only their blob
+    sha is needed to commit them again.
+    """
+    references = get_index().references
+    new = {path: local_path for path, (local_path, blob_sha) in attachments.items()
+           if path not in references and blob_sha not in _uploaded}
+    if progress:
+        for path, (local_path, _) in attachments.items():
+            if path not in new:
+                progress(local_path, None)
+    blobs = upload_files(new, progress)
+    return {path: blobs.get(path, blob_sha) for path, (_, blob_sha) in attachments.items()}
+
+
+def get_head(repo):
+    """Return the branch ref and the commit it points to."""
+    ref = repo.get_git_ref(f"heads/{BRANCH}")
+    return ref, repo.get_git_commit(ref.object.sha)
+
+
+def load_text_at(repo, path, commit_sha):
+    """Load a text file as it is at ``commit_sha``, or None if it doesn't exist."""
+    try:
+        return repo.get_contents(path, ref=commit_sha).decoded_content.decode()
+    except UnknownObjectException:
+        return None
+
+
+def load_events_at(repo, commit_sha):
+    """Load the events not yet compacted into the partitions at ``commit_sha``."""
+    return eventlog.loads(load_text_at(repo, EVENTS_PATH, commit_sha) or "")
+
+
+def upload_blobs(repo, files):
+    """Upload binary ``{path: content}`` as blobs and return ``{path: blob_sha}``."""
+    return {path: repo.create_git_blob(base64.b64encode(content).decode(), "base64").sha
+            for path, content in files.items()}
 
-    # Update the image paths in the new_data before saving
-    new_data['images'] = uploaded_image_paths
 
-    # Handle file uploads
-    uploaded_file_paths = []
-    for img_path in new_data['file']:
+def _upload_file(local_path, priority):
+    with open(local_path, 'rb') as attachment:
+        encoded = base64.b64encode(attachment.read()).decode()
+    for attempt in range(UPLOAD_RETRIES + 1):
         try:
-            # Read the image file
-            img_name1 = img_path[5:]
-            with open(img_path, 'rb') as img_file:
-                img_content = img_file.read()
-
-            # Create filename with timestamp to avoid conflicts
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            img_name = f"file_{timestamp}_{img_name1}"
-            github_img_path = f"data/{img_name}"
-
-            # Upload to GitHub
-            repo.create_file(
-                path=github_img_path,
-                message=f"Add file {img_name}",
-                content=img_content,
-                branch=BRANCH
-            )
-            uploaded_file_paths.append(github_img_path)
+            with github_client.api_call(priority=priority, name="upload_attachment") as repo:
+                sha = repo.create_git_blob(encoded, "base64").sha
+            telemetry.count("github_bytes_sent", len(encoded))
+            return sha
         except Exception as e:
-            print(f"Failed to upload file {img_path}: {str(e)}")
+            if attempt == UPLOAD_RETRIES:
+                raise
+            telemetry.count("github_retries")
+            print(f"Failed to upload {local_path}, retrying ({attempt + 1}/{UPLOAD_RETRIES}): {str(e)}")
+            time.sleep(CONFLICT_BACKOFF * 2 ** attempt)
 
-    # Update the image paths in the new_data before saving
-    new_data['file'] = uploaded_file_paths
 
-    # Append the new data (with updated image paths)
-    current_data.append(new_data)
+def upload_files(attachments, progress=None):
+    """Upload local files (``{github_path: local_path}``) as blobs and return ``{github_path: blob_sha}``.
 
-    print("Updated data:", current_data)
+    Up to ``UPLOAD_WORKERS`` files are uploaded (and held in memory) at once,
+    each retried ``UPLOAD_RETRIES`` times. ``progress(local_path, error)`` is
+    called as every file finishes, with ``error`` None if it was uploaded.
+    Raises :class:`UploadError` once all are done if any of them failed.
+    """
+    blobs = {}
+    failures = {}
+    # Worker threads don't inherit the priority of this one
+    priority = github_client.current_priority()
+    with telemetry.span("submission.upload_attachments"), \
+            ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload") as pool:
+        futures = {pool.submit(_upload_file, local_path, priority): (github_path, local_path)
+                   for github_path, local_path in attachments.items()}
+        for future in as_completed(futures):
+            github_path, local_path = futures[future]
+            try:
+                blobs[github_path] = future.result()
+                _uploaded.add(blobs[github_path])
+                error = None
+            except Exception as e:
+                error = failures[local_path] = str(e)
+            if progress:
+                progress(local_path, error)
+    if failures:
+        raise UploadError(failures)
+    return blobs
+
+
+def commit_files(repo, ref, base_commit, message, files=None, blobs=None, deletions=()):
+    """Commit every file in ``files`` (``{path: str or bytes}``) as a single commit.
+
+    Binary contents are uploaded as blobs first, text goes inline in the tree.
+    ``blobs`` (``{path: blob_sha}``) adds blobs that were uploaded beforehand.
+    The ref is moved without forcing, so the commit is rejected if ``BRANCH``
+    moved past ``base_commit`` in the meantime.
+    """
+    files = files or {}
+    blobs = {**(blobs or {}),
+             **upload_blobs(repo, {path: content for path, content in files.items() if isinstance(content, bytes)})}
+
+    elements = [InputGitTreeElement(path, "100644", "blob", sha=sha) for path, sha in blobs.items()]
+    for path, content in files.items():
+        if isinstance(content, str):
+            elements.append(InputGitTreeElement(path, "100644", "blob", content=content))
+    for path in deletions:
+        elements.append(InputGitTreeElement(path, "100644", "blob", sha=None))
+
+    tree = repo.create_git_tree(elements, base_commit.tree)
+    commit = repo.create_git_commit(message, tree, [base_commit])
+    ref.edit(commit.sha)
+    return commit.sha
+
+
+def tree_sizes(repo, tree_sha):
+    """Return ``{path: size in bytes}`` of every file in a tree (or the tree of a commit)."""
+    return {element.path: element.size for element in repo.get_git_tree(tree_sha, recursive=True).tree
+            if element.type == "blob"}
+
+
+def existing_paths(repo, commit, paths):
+    """Return the ``paths`` that exist in the tree of ``commit``."""
+    if not paths:
+        return []
+    tree = tree_sizes(repo, commit.tree.sha)
+    for path in paths:
+        if path not in tree:
+            print(f"Skipping {path}, it is not in the repo")
+    return [path for path in paths if path in tree]
+
+
+def is_conflict(error):
+    """Whether a GitHub error means the branch moved while we were writing."""
+    return isinstance(error, GithubException) and error.status in (409, 422)
+
+
+def event_months(repo, manifest, events):
+    """Return the months of the requests ``events`` touch.
+
+    Requests created by the events say it themselves; the others are looked
+    up in the partitions, newest first, as most changes are to recent requests.
+    """
+    months = set()
+    codes = set()
+    created = set()
+    for event in events:
+        if event['event'] == eventlog.CREATED:
+            months.add(month_of(event['request']))
+            created.add(event['request'].get('code'))
+        else:
+            codes.add(event['code'])
+    # Requests created in the log itself aren't in any partition
+    codes -= created
+    for month, entry in sorted(manifest.items(), reverse=True):
+        if not codes:
+            break
+        found = codes.intersection(request['code'] for request in read_partition(repo, entry['sha'], entry['path']))
+        if found:
+            months.add(month)
+            codes -= found
+    return months
+
+
+def compacted_files(repo, commit_sha, events):
+    """Fold ``events`` into the partitions at ``commit_sha``.
+
+    Only the partitions of the months the events touch are read and written
+    again, plus the old ones that are ready to be archived. A repo still
+    keeping everything in data.json is split into partitions. Returns
+    ``(files, deletions)`` to commit, with the event log emptied.
+    """
+    manifest_text = load_text_at(repo, partitions.MANIFEST_PATH, commit_sha)
+    if manifest_text is None:
+        legacy = load_text_at(repo, FILE_PATH, commit_sha)
+        manifest = {}
+        snapshot = json.loads(legacy) if legacy else []
+        deletions = [FILE_PATH] if legacy is not None else []
+    else:
+        manifest = json.loads(manifest_text)
+        # Months written before the manifest kept their counts get them now
+        months = event_months(repo, manifest, events) | set(partitions.archivable(manifest)) | \
+            {month for month, entry in manifest.items() if 'counts' not in entry}
+        snapshot = [request for month in sorted(months & manifest.keys())
+                    for request in read_partition(repo, manifest[month]['sha'], manifest[month]['path'])]
+        deletions = []
+
+    index = eventlog.replay([dict(request) for request in snapshot], events)
+    months = partitions.split(index.requests)
+    files, moved = partitions.write(months, manifest)
+    files[EVENTS_PATH] = ""
+    # The next load finds the partitions written here already parsed
+    for month, requests in months.items():
+        _parsed.setdefault(manifest[month]['sha'], requests)
+    return files, deletions + moved
+
+
+def append_events(events, message, blobs=None, force_compaction=False, deletions=()):
+    """Append ``events`` to the event log in one commit, together with ``blobs``.
+
+    Only the short event log is rewritten. Once it holds ``COMPACT_EVERY``
+    events it is folded into the monthly partitions in the same commit and
+    emptied (see ``compacted_files``).
+    ``deletions`` lists paths removed in the same commit; those already gone are skipped.
+    When which paths can go depends on the requests, ``deletions`` is instead
+    a function returning them from the :class:`RequestIndex` of the commit
+    the write builds on; it is called again on every retry.
+    If another commit lands on the branch meanwhile, the commit is retried.
+    """
+    for attempt in range(CONFLICT_RETRIES + 1):
+        head_sha = None
+        paths = deletions
+        if callable(deletions):
+            head_sha, index = get_index_at_head()
+            paths = deletions(index)
+        with github_client.api_call(cost=8 if paths else 7, name="commit") as repo:
+            ref, base_commit = get_head(repo)
+            # Deletions worked out on an older commit may remove what the newer one uses
+            if head_sha is None or base_commit.sha == head_sha:
+                existing = existing_paths(repo, base_commit, paths)
+                log = load_text_at(repo, EVENTS_PATH, base_commit.sha) or ""
+                logged = eventlog.loads(log)
+
+                if force_compaction or len(logged) + len(events) >= COMPACT_EVERY:
+                    files, moved = compacted_files(repo, base_commit.sha, logged + events)
+                else:
+                    files, moved = {EVENTS_PATH: log + eventlog.dumps(events)}, []
+
+                try:
+                    commit_sha = commit_files(repo, ref, base_commit, message, files, blobs, existing + moved)
+                    telemetry.count("github_bytes_sent", sum(len(content) for content in files.values()))
+                    cache.invalidate()
+                    return commit_sha
+                except GithubException as e:
+                    if not is_conflict(e) or attempt == CONFLICT_RETRIES:
+                        raise
+            elif attempt == CONFLICT_RETRIES:
+                raise RuntimeError(f"Branch kept moving while saving, gave up after {CONFLICT_RETRIES} retries")
+        print(f"Branch moved while saving, retrying ({attempt + 1}/{CONFLICT_RETRIES})")
+        telemetry.count("github_retries")
+        time.sleep(CONFLICT_BACKOFF * 2 ** attempt)
+
+
+def compact():
+    """Fold the event log into the partitions now."""
+    return append_events([], "Compact event log", force_compaction=True)
+
+
+def append_requests(new_requests, progress=None, digests=None):
+    """Add several requests and upload their attachments in one commit.
+
+    ``progress`` is told about every attachment as it is uploaded (see
+    ``upload_files``); ``digests`` are those of attachments hashed already
+    (see ``name_attachments``).
+    """
+    # Collect attachments and update their paths in the requests before saving
+    attachments = {}
+    failures = {}
+    for new_data in new_requests:
+        for key, kind in (('images', "image"), ('file', "file")):
+            try:
+                new_data[key] = name_attachments(new_data[key], kind, attachments, progress, digests)
+            except UploadError as e:
+                failures.update(e.failures)
+    if failures:
+        raise UploadError(failures)
+    blobs = upload_attachments(attachments, progress)
 
     # Commit message
     tz = pytz.timezone('UTC')
     timestamp = datetime.datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S %Z')
     commit_message = f"Automated update via Streamlit form at {timestamp}"
+    if len(new_requests) > 1:
+        commit_message += f" ({len(new_requests)} requests)"
+
+    append_events([eventlog.created(new_data) for new_data in new_requests], commit_message, blobs)
+    # Committed, their requests reference them from now on
+    _uploaded.difference_update(blobs.values())
+
+
+def update_json(new_data):
+    """Add a request and upload its attachments in one commit"""
+    append_requests([new_data])
+
+
+def update_state(code, state):
+    """Update the state of the request identified by ``code``."""
+    append_events([eventlog.state_changed(code, state)], f"Update request status to {state}")
+
+
+def update_states(codes, state):
+    """Update the state of every request in ``codes`` in a single commit.
+
+    Returns ``{code: error}``, where ``error`` is None for the requests that were updated.
+    """
+    index = get_index()
+    results = {code: None if code in index else "Request not found" for code in codes}
+    events = [eventlog.state_changed(code, state) for code, error in results.items() if error is None]
+    if events:
+        try:
+            append_events(events, f"Update status of {len(events)} requests to {state}")
+        except Exception as e:
+            results.update((code, str(e)) for code, error in results.items() if error is None)
+    return results
+
+
+def attach_files(code, images, files):
+    """Upload extra attachments and add them to an existing request."""
+    attachments = {}
+    image_paths = name_attachments(images, "image", attachments)
+    file_paths = name_attachments(files, "file", attachments)
+    blobs = upload_attachments(attachments)
+
+    append_events([eventlog.attached(code, image_paths, file_paths)], "Attach files to request", blobs)
+
+
+def clean_images_and_files(codes=None, dry_run=False):
+    """Delete the attachments of posted requests from the repo in a single commit.
+
+    ``codes`` limits the cleanup to those requests; by default only the posted
+    requests that still have attachments are visited. With ``dry_run`` nothing
+    is deleted. Returns ``({code: error}, bytes reclaimed)``, where ``error``
+    is None for the requests that were (or would be) cleaned.
+    """
+    index = get_index()
+    results = {}
+    requests_to_clean = {}
+    for code in index.pending_cleanup if codes is None else codes:
+        request = index.get(code)
+        if request is None:
+            results[code] = "Request not found"
+        elif request['state'] != states.POSTED:
+            results[code] = "Request is not posted yet"
+        else:
+            results[code] = None
+            if request['images'] or request['file']:
+                requests_to_clean[code] = request
+    if not requests_to_clean:
+        return results, 0
+
+    deleted = {}  # path -> size of every attachment the cleanup deletes
+
+    def deletions_at(index):
+        # An attachment listed by requests that are not being cleaned stays, including requests
+        # saved after the cached index was loaded, so this runs on the index of the commit written on
+        cleaned = [index.get(code) for code in requests_to_clean]
+        paths = index.unreferenced([path for request in cleaned if request is not None
+                                    for path in request['images'] + request['file']], requests_to_clean)
+        paths += [derived for path in paths for derived in attachment_store.derived_paths(path)
+                  if derived in index.files]
+        deleted.clear()
+        deleted.update((path, index.files.get(path, 0)) for path in paths)
+        return paths
+
+    if dry_run:
+        deletions_at(index)
+        return results, sum(deleted.values())
+    try:
+        append_events([eventlog.attachments_cleaned(code) for code in requests_to_clean],
+                      f"Clean up images and files of {len(requests_to_clean)} requests", deletions=deletions_at)
+    except Exception as e:
+        results.update((code, str(e)) for code in requests_to_clean)
+        return results, 0
+    return results, sum(deleted.values())
+
 
-    # Update the JSON file
-    repo.update_file(
-        path=FILE_PATH,
-        message=commit_message,
-        content=json.dumps(current_data, indent=4),
-        sha=sha,
-        branch=BRANCH
-    )
+if __name__ == "__main__":
+    compact()
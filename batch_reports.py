@@ -0,0 +1,162 @@
+"""Generate the reports of many periods at once.
+
+The requests are read once, from the columnar snapshot of the current
+data version (see ``snapshot_cache``), and counted for every period in a
+single groupby, the charts of every report are rendered together in the chart
+worker pool, and each report is written to ``--output`` as
+``report_<period>.html``. Reports go through the report cache too, so
+periods whose data didn't change since the last run are not rebuilt, and
+the dashboard finds the monthly ones ready::
+
+    python batch_reports.py --year 2024 --monthly --quarterly --yearly
+    python batch_reports.py --range 20240101 20240315
+"""
+import argparse
+import os
+import shutil
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import charts
+import report_cache
+import reports
+import snapshot_cache
+import states
+from aggregates import add_count, empty_rollup
+from storage import get_store
+
+OUTPUT_DIR = "report_archive"
+BOUND_FORMATS = {4: "%Y", 6: "%Y%m", 8: "%Y%m%d"}  # Timestamp prefixes the periods start and end at
+
+# name is also the report cache key, start and end are timestamp prefixes (end exclusive)
+Period = namedtuple('Period', ['name', 'start', 'end', 'year', 'month', 'heading'])
+
+
+def monthly(year):
+    return [Period(f"{year}_{month}", f"{year:04d}{month:02d}",
+                   f"{year + month // 12:04d}{month % 12 + 1:02d}", year, month, None)
+            for month in range(1, 13)]
+
+
+def quarterly(year):
+    return [Period(f"{year}_Q{quarter}", f"{year:04d}{quarter * 3 - 2:02d}",
+                   f"{year:04d}{quarter * 3 + 1:02d}" if quarter < 4 else f"{year + 1:04d}", year, None,
+                   f"Reporte trimestral - T{quarter} {year}")
+            for quarter in range(1, 5)]
+
+
+def yearly(year):
+    return [Period(f"{year}_all", f"{year:04d}", f"{year + 1:04d}", year, None, None)]
+
+
+def date_range(first, last):
+    """The days from ``first`` to ``last`` (``YYYYMMDD``), both included."""
+    start, end = datetime.strptime(first, "%Y%m%d"), datetime.strptime(last, "%Y%m%d")
+    return Period(f"{first}-{last}", first, (end + timedelta(days=1)).strftime("%Y%m%d"), None, None,
+                  f"Reporte del {start:%d-%m-%Y} al {end:%d-%m-%Y}")
+
+
+def _bound(prefix):
+    return datetime.strptime(prefix, BOUND_FORMATS[len(prefix)])
+
+
+def count_periods(df, periods):
+    """Return the rollup of every request, and the rollup and posted requests of every period.
+
+    ``df`` holds the requests oldest first, as ``snapshot_cache`` gives
+    them. Every period is a slice of them, and all the slices are counted in
+    one groupby.
+    """
+    bounds = df['timestamp'].searchsorted([_bound(bound) for period in periods
+                                           for bound in (period.start, period.end)])
+    rows = pd.concat([df.iloc[bounds[2 * i]:bounds[2 * i + 1]].assign(period=period.name)
+                      for i, period in enumerate(periods)])
+
+    keys = ['department', 'user_email', 'state']
+    history = empty_rollup()
+    for (department, user_email, state), count in df.groupby(keys, observed=True).size().items():
+        add_count(history, department, user_email, state, int(count))
+
+    rollups = {period.name: empty_rollup() for period in periods}
+    for (name, department, user_email, state), count in rows.groupby(['period'] + keys, observed=True).size().items():
+        add_count(rollups[name], department, user_email, state, int(count))
+
+    posted = {period.name: [] for period in periods}
+    for name, group in rows[rows['state'] == states.POSTED].groupby('period'):
+        posted[name] = group[['topic', 'message', 'department']].to_dict('records')
+    return history, rollups, posted
+
+
+def generate(periods, output_dir=OUTPUT_DIR):
+    """Write the report of every period to ``output_dir`` and return ``{period name: path}``."""
+    store = get_store()
+    version = store.data_version()
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {period.name: os.path.join(output_dir, f"report_{period.name}.html") for period in periods}
+
+    missing = []
+    for period in periods:
+        cached = report_cache.cached_report(period.name, version)
+        if cached:
+            shutil.copyfile(cached, paths[period.name])
+        else:
+            missing.append(period)
+    if not missing:
+        return paths
+
+    history, rollups, posted = count_periods(snapshot_cache.load(store), missing)
+    stats = {period.name: reports.compute_statistics(history, rollups[period.name], posted[period.name])
+             for period in missing}
+    with_charts = [period for period in missing if not stats[period.name]['dept_stats'].empty]
+    uris = charts.render([chart for period in with_charts
+                          for chart in reports.chart_inputs(stats[period.name]['dept_stats'])])
+    chart_uris = {period.name: (uris[2 * i], uris[2 * i + 1]) for i, period in enumerate(with_charts)}
+
+    for period in missing:
+        pie_chart, bar_chart = chart_uris.get(period.name, ('', ''))
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_path = report_cache.get_report(
+            period.name, version,
+            lambda report_dir: reports.generate_report_html(
+                period.month, period.year, pie_chart=pie_chart, bar_chart=bar_chart, report_dir=report_dir,
+                timestamp=timestamp, heading=period.heading, **stats[period.name]))
+        # Copied right away, the cache may evict it while the rest of the batch is written
+        shutil.copyfile(report_path, paths[period.name])
+    return paths
+
+
+def request_years():
+    """Return every year with requests."""
+    first = get_store().list_requests(order_by='timestamp', limit=1)
+    last = get_store().list_requests(order_by='timestamp', descending=True, limit=1)
+    if not first:
+        return []
+    return list(range(int(first[0]['timestamp'][:4]), int(last[0]['timestamp'][:4]) + 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--year", type=int, action="append",
+                        help="year of the calendar periods, may be repeated (default: every year with requests)")
+    parser.add_argument("--monthly", action="store_true", help="one report per month")
+    parser.add_argument("--quarterly", action="store_true", help="one report per quarter")
+    parser.add_argument("--yearly", action="store_true", help="one report per year")
+    parser.add_argument("--range", nargs=2, action="append", default=[], metavar=("FIRST", "LAST"),
+                        help="a report from day FIRST to day LAST (YYYYMMDD, both included), may be repeated")
+    parser.add_argument("--output", default=OUTPUT_DIR, help=f"where to write the reports (default: {OUTPUT_DIR})")
+    args = parser.parse_args()
+
+    calendar = [kind for kind, wanted in ((monthly, args.monthly), (quarterly, args.quarterly), (yearly, args.yearly))
+                if wanted]
+    if not calendar and not args.range:
+        calendar = [monthly, quarterly, yearly]
+    years = args.year
+    if calendar and not years:
+        years = request_years()
+    periods = [period for year in years or () for kind in calendar for period in kind(year)]
+    periods += [date_range(first, last) for first, last in args.range]
+
+    for name, path in generate(periods, args.output).items():
+        print(f"{name}: {path}")
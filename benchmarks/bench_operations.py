@@ -0,0 +1,169 @@
+"""Measure the main operations of the apps as the requests grow.
+
+For every dataset size, a fake GitHub repo is seeded with generated
+monthly partitions and their attachments, and each operation is timed against it:
+opening the dashboard (a cold and a warm load of the first page), saving a
+submission, marking a request as posted, cleaning up attachments and
+generating a monthly report. Every operation reports its wall time, API
+round trips, bytes sent and received and the peak memory it allocated
+(traced with tracemalloc, which also slows it down; pass --no-memory for
+clean timings). Results are written as JSON to compare versions.
+
+Run from the repository root (the app's Streamlit secrets must be readable,
+the token itself is never sent anywhere but the fake server)::
+
+    python -m benchmarks.bench_operations --sizes 1000 10000 100000 --latency 0.05 --output /tmp/results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import automation
+import cleanup
+import github_client
+import partitions
+import report_cache
+import reports
+import states
+import storage
+from benchmarks.datagen import attachment_paths, generate
+from benchmarks.fake_github import FakeGithubServer
+
+ATTACHMENT_SIZE = 4096  # Bytes of every seeded attachment
+PAGE_SIZE = 25  # Requests on the dashboard's first page
+
+
+def measure(server, operation, memory=True):
+    """Run ``operation`` and return its wall time, traffic and peak traced memory."""
+    server.reset_stats()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        operation()
+        seconds = time.perf_counter() - started
+    finally:
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+    stats = server.stats()
+    return {'seconds': round(seconds, 4), 'round_trips': stats['round_trips'], 'commits': stats['commits'],
+            'bytes_in': stats['bytes_in'], 'bytes_out': stats['bytes_out'], 'peak_memory': peak,
+            'calls': stats['calls']}
+
+
+def open_dashboard():
+    """What the dashboard does to show its first page."""
+    store = storage.get_store()
+    store.count_requests()
+    store.list_requests(order_by='timestamp', descending=True, limit=PAGE_SIZE)
+
+
+def cold_open_dashboard():
+    automation.cache.invalidate()
+    automation._manifest = (None, {})
+    automation._parsed = {}
+    open_dashboard()
+
+
+def submit(directory):
+    path = os.path.join(directory, "flyer.pdf")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(64 * 1024))
+    storage.get_store().create_request({
+        'code': None, 'user_name': "Bench", 'user_email': "bench@fbio.uh.cu", 'topic': "Bench",
+        'message': "Bench", 'images': [], 'file': [path], 'state': states.PENDING, 'department': "Otro",
+        'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S")})
+
+
+def request_posted(requests):
+    """Same as the dashboard's "Mark as posted" (management.request_posted)."""
+    code = next(request['code'] for request in reversed(requests) if request['state'] == states.PENDING)
+    storage.get_store().update_state(code, states.POSTED)
+
+
+def clean_attachments():
+    """The job the dashboard's "Clean Up" button starts (management.action_to_clean_images_and_files)."""
+    cleanup.run()
+
+
+def monthly_report(year, month):
+    path, message = reports.get_statistics(year=year, month=month)
+    if path is None:
+        raise RuntimeError(message)
+
+
+def run(size, latency, memory=True):
+    """Benchmark every operation on a dataset of ``size`` requests."""
+    requests = generate(size)
+    files = {path: os.urandom(ATTACHMENT_SIZE) for path in attachment_paths(requests)}
+    data, _ = partitions.write(partitions.split(requests), {})
+    files.update((path, content.encode() if isinstance(content, str) else content) for path, content in data.items())
+    files[automation.EVENTS_PATH] = b""
+    last = datetime.strptime(requests[-1]['timestamp'], "%Y%m%d_%H%M%S")
+
+    with FakeGithubServer(latency=latency) as server, tempfile.TemporaryDirectory() as directory:
+        server.seed(files)
+        github_client.reset(server.url)
+        storage._store = storage.GithubStore()
+        report_cache.REPORT_DIR = os.path.join(directory, "reports")
+        os.makedirs(report_cache.REPORT_DIR)
+
+        return {
+            'data_bytes': sum(len(content) for content in data.values()),
+            'partitions': len(data) - 1,
+            'attachments': len(files) - len(data) - 1,
+            'operations': {
+                'load_data_cold': measure(server, cold_open_dashboard, memory),
+                'load_data_warm': measure(server, open_dashboard, memory),
+                'update_json': measure(server, lambda: submit(directory), memory),
+                'request_posted': measure(server, lambda: request_posted(requests), memory),
+                'clean_images_and_files': measure(server, clean_attachments, memory),
+                'get_statistics': measure(server, lambda: monthly_report(last.year, last.month), memory),
+            },
+        }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="requests in the dataset")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every round trip")
+    parser.add_argument("--no-memory", action="store_true", help="don't trace memory, for undisturbed timings")
+    # Required, a default would leave a results file in the checkout when run from the repository root
+    parser.add_argument("--output", required=True, help="where to write the results, as JSON")
+    args = parser.parse_args()
+
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'latency': args.latency,
+        'started': datetime.now().isoformat(timespec="seconds"),
+        'sizes': {},
+    }
+    for size in args.sizes:
+        results['sizes'][str(size)] = run(size, args.latency, not args.no_memory)
+        for name, stats in results['sizes'][str(size)]['operations'].items():
+            memory = "" if stats['peak_memory'] is None else f", {stats['peak_memory'] / 2 ** 20:.1f} MB peak"
+            print(f"{size:>8} {name:<24} {stats['seconds']:>8.3f} s, {stats['round_trips']} round trips, "
+                  f"{stats['bytes_in'] + stats['bytes_out']} bytes{memory}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare the GitHub round trips of a form submission before and after the
+switch to a single Git Data API commit.
+
+Run from the repository root (the app's Streamlit secrets must be readable,
+the token itself is never sent anywhere but the fake server)::
+
+    python -m benchmarks.bench_submission --attachments 8 --latency 0.05
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from github import Github
+
+import automation
+import github_client
+from benchmarks.fake_github import FakeGithubServer
+
+
+def legacy_update_json(repo, new_data):
+    """The submission path as it was before: one create_file per attachment, then update_file."""
+    file = repo.get_contents(automation.FILE_PATH, ref=automation.BRANCH)
+    sha = file.sha
+    current_data = json.loads(file.decoded_content.decode())
+
+    for key, kind in (('images', "image"), ('file', "file")):
+        uploaded_paths = []
+        for local_path in new_data[key]:
+            with open(local_path, 'rb') as attachment:
+                content = attachment.read()
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            github_path = f"data/{kind}_{timestamp}_{os.path.basename(local_path)}"
+            repo.create_file(path=github_path, message=f"Add {kind}", content=content, branch=automation.BRANCH)
+            uploaded_paths.append(github_path)
+        new_data[key] = uploaded_paths
+
+    current_data.append(new_data)
+    repo.update_file(path=automation.FILE_PATH, message="Automated update", content=json.dumps(current_data, indent=4),
+                     sha=sha, branch=automation.BRANCH)
+
+
+def make_submission(directory, attachments, size):
+    images = []
+    for i in range(attachments):
+        path = os.path.join(directory, f"attachment_{i}.png")
+        with open(path, 'wb') as attachment:
+            attachment.write(os.urandom(size))
+        images.append(path)
+    return {'code': 0, 'user_name': "Bench", 'user_email': "bench@example.com", 'topic': "Bench",
+            'message': "Bench", 'images': images, 'file': [], 'state': "pending",
+            'department': "Otro", 'timestamp': datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}
+
+
+def measure(server, submit):
+    server.reset_stats()
+    started = time.perf_counter()
+    submit()
+    stats = server.stats()
+    stats['seconds'] = round(time.perf_counter() - started, 4)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--attachments", type=int, default=8)
+    parser.add_argument("--size", type=int, default=64 * 1024, help="bytes per attachment")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every round trip")
+    args = parser.parse_args()
+
+    with FakeGithubServer(latency=args.latency) as server, tempfile.TemporaryDirectory() as directory:
+        server.seed({automation.FILE_PATH: b"[]"})
+        github_client.reset(server.url)
+        repo = Github("benchmark", base_url=server.url).get_repo(github_client.REPO_NAME)
+
+        results = {
+            'before': measure(server, lambda: legacy_update_json(
+                repo, make_submission(directory, args.attachments, args.size))),
+            'after': measure(server, lambda: automation.update_json(
+                make_submission(directory, args.attachments, args.size))),
+        }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Generate realistic data.json datasets for the benchmarks.
+
+Requests are spread over the last years in submission order, come from a
+pool of returning users of the form's departments, and most of the old
+ones are posted with their attachments already cleaned up. Attachments use
+the content-addressed paths of ``attachment_store``, and some are shared
+between requests like re-sent flyers are. The same seed always gives the
+same dataset::
+
+    python -m benchmarks.datagen --count 100000 --output /tmp/data.json
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+import states
+from attachment_store import ATTACHMENTS_DIR
+from request_index import request_code
+
+# The departments offered by the form in main.py, the first ones the busiest
+DEPARTMENTS = ["Microbiología", "Bioquímica", "Biología Animal y Humana", "Biología Vegetal", "CEP", "Otro"]
+DEPARTMENT_WEIGHTS = [30, 25, 15, 15, 10, 5]
+FIRST_NAMES = ["Ana", "Carlos", "María", "José", "Laura", "Pedro", "Lucía", "Jorge", "Elena", "Raúl", "Karen", "Yanet"]
+LAST_NAMES = ["García", "Pérez", "Rodríguez", "González", "Hernández", "López", "Díaz", "Cantero", "Fernández"]
+WORDS = ["defensa", "tesis", "conferencia", "seminario", "convocatoria", "curso", "taller", "resultados", "beca",
+         "evento", "premio", "graduación", "laboratorio", "proyecto", "publicación", "reunión", "claustro", "horario"]
+IMAGE_RATE = 0.35  # Requests with images
+FILE_RATE = 0.15  # Requests with documents
+SHARED_RATE = 0.05  # Attachments that another request already sent
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _attachments(rng, count, extensions, sent):
+    paths = []
+    for _ in range(count):
+        if sent and rng.random() < SHARED_RATE:
+            paths.append(rng.choice(sent))
+        else:
+            paths.append(f"{ATTACHMENTS_DIR}/{rng.getrandbits(256):064x}{rng.choice(extensions)}")
+            sent.append(paths[-1])
+    return paths
+
+
+def generate(count, seed=0, years=5, end=datetime(2025, 6, 1)):
+    """Return ``count`` requests submitted over the ``years`` before ``end``, oldest first."""
+    rng = random.Random(seed)
+    users = [(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", rng.choices(DEPARTMENTS, DEPARTMENT_WEIGHTS)[0])
+             for _ in range(max(10, int(count ** 0.5)))]
+    start = end - timedelta(days=365 * years)
+    step = (end - start) / count
+    sent = []
+    requests = []
+    for n in range(count):
+        name, department = rng.choice(users)
+        submitted = start + step * n + timedelta(seconds=rng.randrange(int(step.total_seconds()) + 1))
+        age = (end - submitted).days
+        # Recent requests are still waiting; old ones were posted and cleaned up
+        roll = rng.random()
+        state = states.PENDING if roll < (0.6 if age < 7 else 0.03) else (
+            states.APPROVED_BY_USER if roll > 0.97 else states.POSTED)
+        cleaned = state == states.POSTED and age > 30
+        request = {
+            'user_name': name,
+            'user_email': f"{name.split()[0].lower()}.{name.split()[1].lower()}@fbio.uh.cu",
+            'topic': _sentence(rng, 3),
+            'message': _sentence(rng, rng.randint(8, 40)),
+            'images': [] if cleaned or rng.random() > IMAGE_RATE else
+            _attachments(rng, rng.randint(1, 4), [".jpg", ".png"], sent),
+            'file': [] if cleaned or rng.random() > FILE_RATE else
+            _attachments(rng, 1, [".pdf", ".docx"], sent),
+            'state': state,
+            'department': department,
+            'timestamp': submitted.strftime("%Y%m%d_%H%M%S"),
+        }
+        if state == states.POSTED:
+            request['posted_timestamp'] = (submitted + timedelta(days=rng.randint(0, 3))).strftime("%Y%m%d_%H%M%S")
+        request['code'] = request_code(request)
+        requests.append(request)
+    return requests
+
+
+def attachment_paths(requests):
+    """Return every attachment path the requests list."""
+    return sorted({path for request in requests for path in request['images'] + request['file']})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1000, help="requests to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--years", type=int, default=5, help="years the requests are spread over")
+    # Required, a default would overwrite the app's data.json when run from the repository root
+    parser.add_argument("--output", required=True, help="where to write the requests, as JSON")
+    args = parser.parse_args()
+
+    requests = generate(args.count, args.seed, args.years)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(requests, f, indent=4)
+    print(f"Wrote {len(requests)} requests with {len(attachment_paths(requests))} attachments to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
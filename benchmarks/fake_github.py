@@ -0,0 +1,384 @@
+"""In-process fake of the GitHub REST endpoints used by the apps.
+
+Covers the contents API (get/create/update/delete a file) and the git data
+API (refs, commits, trees, blobs) for a single repository, and counts every
+round trip so the write paths can be compared. Point PyGithub at it with
+``Github(token, base_url=server.url)``.
+"""
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _sha(kind, payload):
+    # Same object ids as git, so clients can compute blob shas themselves
+    return hashlib.sha1(f"{kind} {len(payload)}\0".encode() + payload).hexdigest()
+
+
+class FakeRepo:
+    """A single-branch git repository kept in memory.
+
+    Trees are flat ``{path: blob_sha}`` mappings, which is all the apps need.
+    """
+
+    def __init__(self, branch="main"):
+        self.branch = branch
+        self.lock = threading.Lock()
+        self.blobs = {}
+        self.trees = {}
+        self.commits = {}
+        self.head = self._commit("Initial commit", self._tree({}), [])
+
+    def _blob(self, content):
+        sha = _sha("blob", content)
+        self.blobs[sha] = content
+        return sha
+
+    def _tree(self, entries):
+        sha = _sha("tree", json.dumps(entries, sort_keys=True).encode())
+        self.trees[sha] = dict(entries)
+        return sha
+
+    def _commit(self, message, tree, parents):
+        sha = _sha("commit", json.dumps([message, tree, parents, time.time()]).encode())
+        self.commits[sha] = {'message': message, 'tree': tree, 'parents': parents}
+        return sha
+
+    def resolve(self, ref):
+        """Return the commit sha for a branch name or commit sha."""
+        if ref in (None, self.branch):
+            return self.head
+        return ref
+
+    def files(self, ref=None):
+        return self.trees[self.commits[self.resolve(ref)]['tree']]
+
+    def read(self, path, ref=None):
+        sha = self.files(ref).get(path)
+        return None if sha is None else self.blobs[sha]
+
+    def write(self, changes, message):
+        """Commit ``{path: bytes or None}`` on top of the branch head."""
+        with self.lock:
+            entries = dict(self.files())
+            for path, content in changes.items():
+                if content is None:
+                    entries.pop(path, None)
+                else:
+                    entries[path] = self._blob(content)
+            self.head = self._commit(message, self._tree(entries), [self.head])
+            return self.head
+
+    def is_ancestor(self, ancestor, sha):
+        pending = [sha]
+        while pending:
+            current = pending.pop()
+            if current == ancestor:
+                return True
+            pending.extend(self.commits[current]['parents'])
+        return False
+
+
+class FakeGithubServer(ThreadingHTTPServer):
+    """HTTP server wrapping a :class:`FakeRepo`.
+
+    ``latency`` seconds are slept before answering each request, to mimic
+    the round trip to api.github.com.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, repo_name="karendcl/fbio-web-requests", latency=0.0, port=0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.repo_name = repo_name
+        self.latency = latency
+        self.repo = FakeRepo()
+        self.calls = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.commit_count = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def repo_url(self):
+        return f"{self.url}/repos/{self.repo_name}"
+
+    def seed(self, files):
+        """Put ``{path: bytes}`` in the repo without counting it as traffic."""
+        self.repo.write(files, "Seed")
+
+    def reset_stats(self):
+        self.calls.clear()
+        self.bytes_in = self.bytes_out = self.commit_count = 0
+
+    def stats(self):
+        return {
+            'round_trips': sum(self.calls.values()),
+            'commits': self.commit_count,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'calls': dict(self.calls),
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeGithubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        etag = None
+        if self.command == "GET" and status == 200:
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+        self.server.bytes_out += len(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", "5000")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        self.server.bytes_in += len(raw)
+        return json.loads(raw) if raw else {}
+
+    def _dispatch(self, method):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        parsed = urlparse(self.path)
+        prefix = f"/repos/{self.server.repo_name}"
+        if not parsed.path.startswith(prefix):
+            return self._send(404, {'message': "Not Found"})
+        route = parsed.path[len(prefix):]
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        for pattern, name, handler in ROUTES:
+            match = re.fullmatch(pattern, route)
+            if match and name.split(" ")[0] == method:
+                self.server.calls[name] += 1
+                return handler(self, query, *match.groups())
+        return self._send(404, {'message': "Not Found"})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    # --- payload helpers -------------------------------------------------
+
+    def _commit_json(self, sha):
+        commit = self.server.repo.commits[sha]
+        base = self.server.repo_url
+        return {
+            'sha': sha,
+            'url': f"{base}/git/commits/{sha}",
+            'message': commit['message'],
+            'tree': {'sha': commit['tree'], 'url': f"{base}/git/trees/{commit['tree']}"},
+            'parents': [{'sha': parent, 'url': f"{base}/git/commits/{parent}"} for parent in commit['parents']],
+        }
+
+    def _ref_json(self):
+        base = self.server.repo_url
+        repo = self.server.repo
+        return {
+            'ref': f"refs/heads/{repo.branch}",
+            'url': f"{base}/git/refs/heads/{repo.branch}",
+            'object': {'sha': repo.head, 'type': "commit", 'url': f"{base}/git/commits/{repo.head}"},
+        }
+
+    def _content_json(self, path, ref=None):
+        repo = self.server.repo
+        sha = repo.files(ref)[path]
+        content = repo.blobs[sha]
+        return {
+            'type': "file",
+            'encoding': "base64",
+            'size': len(content),
+            'name': path.rsplit("/", 1)[-1],
+            'path': path,
+            'sha': sha,
+            'content': base64.b64encode(content).decode(),
+            'url': f"{self.server.repo_url}/contents/{path}",
+        }
+
+    # --- endpoints -------------------------------------------------------
+
+    def get_repo(self, query):
+        owner, name = self.server.repo_name.split("/")
+        self._send(200, {'name': name, 'full_name': self.server.repo_name, 'owner': {'login': owner},
+                         'url': self.server.repo_url, 'default_branch': self.server.repo.branch})
+
+    def get_contents(self, query, path):
+        repo = self.server.repo
+        files = repo.files(query.get('ref'))
+        if path in files:
+            return self._send(200, self._content_json(path, query.get('ref')))
+        listing = [self._content_json(name, query.get('ref')) for name in sorted(files)
+                   if name.startswith(path.rstrip("/") + "/") and "/" not in name[len(path.rstrip("/")) + 1:]]
+        if listing:
+            return self._send(200, listing)
+        self._send(404, {'message': "Not Found"})
+
+    def put_contents(self, query, path):
+        body = self._body()
+        repo = self.server.repo
+        current = repo.files().get(path)
+        if current is not None and body.get('sha') != current:
+            return self._send(409 if body.get('sha') else 422, {'message': f"{path} does not match"})
+        sha = repo.write({path: base64.b64decode(body['content'])}, body['message'])
+        self.server.commit_count += 1
+        self._send(201 if current is None else 200,
+                   {'content': self._content_json(path), 'commit': self._commit_json(sha)})
+
+    def delete_contents(self, query, path):
+        body = self._body()
+        repo = self.server.repo
+        current = repo.files().get(path)
+        if current is None:
+            return self._send(404, {'message': "Not Found"})
+        if body.get('sha') != current:
+            return self._send(409, {'message': f"{path} does not match"})
+        sha = repo.write({path: None}, body['message'])
+        self.server.commit_count += 1
+        self._send(200, {'content': None, 'commit': self._commit_json(sha)})
+
+    def get_ref(self, query, branch):
+        if branch != self.server.repo.branch:
+            return self._send(404, {'message': "Not Found"})
+        self._send(200, self._ref_json())
+
+    def update_ref(self, query, branch):
+        body = self._body()
+        repo = self.server.repo
+        with repo.lock:
+            if body['sha'] not in repo.commits:
+                return self._send(422, {'message': "Object does not exist"})
+            if not body.get('force') and not repo.is_ancestor(repo.head, body['sha']):
+                return self._send(422, {'message': "Update is not a fast forward"})
+            repo.head = body['sha']
+        self.server.commit_count += 1
+        self._send(200, self._ref_json())
+
+    def get_commit(self, query, sha):
+        if sha not in self.server.repo.commits:
+            return self._send(404, {'message': "Not Found"})
+        self._send(200, self._commit_json(sha))
+
+    def create_commit(self, query):
+        body = self._body()
+        repo = self.server.repo
+        with repo.lock:
+            sha = repo._commit(body['message'], body['tree'], body.get('parents', []))
+        self._send(201, self._commit_json(sha))
+
+    def create_blob(self, query):
+        body = self._body()
+        content = body['content']
+        content = base64.b64decode(content) if body.get('encoding') == "base64" else content.encode()
+        with self.server.repo.lock:
+            sha = self.server.repo._blob(content)
+        self._send(201, {'sha': sha, 'url': f"{self.server.repo_url}/git/blobs/{sha}"})
+
+    def get_blob(self, query, sha):
+        content = self.server.repo.blobs.get(sha)
+        if content is None:
+            return self._send(404, {'message': "Not Found"})
+        self._send(200, {'sha': sha, 'size': len(content), 'encoding': "base64",
+                         'content': base64.b64encode(content).decode(),
+                         'url': f"{self.server.repo_url}/git/blobs/{sha}"})
+
+    def create_tree(self, query):
+        body = self._body()
+        repo = self.server.repo
+        with repo.lock:
+            entries = dict(repo.trees[body['base_tree']]) if body.get('base_tree') else {}
+            for element in body['tree']:
+                if 'content' in element:
+                    entries[element['path']] = repo._blob(element['content'].encode())
+                elif element.get('sha') is None:
+                    entries.pop(element['path'], None)
+                elif element['sha'] not in repo.blobs:
+                    return self._send(422, {'message': f"Invalid tree info: {element['sha']}"})
+                else:
+                    entries[element['path']] = element['sha']
+            sha = repo._tree(entries)
+        self._send(201, self._tree_json(sha))
+
+    def get_tree(self, query, sha):
+        repo = self.server.repo
+        sha = repo.commits[sha]['tree'] if sha in repo.commits else sha
+        if sha not in repo.trees:
+            return self._send(404, {'message': "Not Found"})
+        self._send(200, self._tree_json(sha))
+
+    def _tree_json(self, sha):
+        repo = self.server.repo
+        base = self.server.repo_url
+        return {
+            'sha': sha,
+            'url': f"{base}/git/trees/{sha}",
+            'truncated': False,
+            'tree': [{'path': path, 'mode': "100644", 'type': "blob", 'sha': blob,
+                      'size': len(repo.blobs[blob]), 'url': f"{base}/git/blobs/{blob}"}
+                     for path, blob in sorted(repo.trees[sha].items())],
+        }
+
+
+ROUTES = [
+    (r"", "GET repo", _Handler.get_repo),
+    (r"/contents/(.+)", "GET contents", _Handler.get_contents),
+    (r"/contents/(.+)", "PUT contents", _Handler.put_contents),
+    (r"/contents/(.+)", "DELETE contents", _Handler.delete_contents),
+    (r"/git/refs?/heads/(.+)", "GET ref", _Handler.get_ref),
+    (r"/git/refs/heads/(.+)", "PATCH ref", _Handler.update_ref),
+    (r"/git/commits/([0-9a-f]+)", "GET commit", _Handler.get_commit),
+    (r"/git/commits", "POST commit", _Handler.create_commit),
+    (r"/git/blobs", "POST blob", _Handler.create_blob),
+    (r"/git/blobs/([0-9a-f]+)", "GET blob", _Handler.get_blob),
+    (r"/git/trees", "POST tree", _Handler.create_tree),
+    (r"/git/trees/([0-9a-f]+)", "GET tree", _Handler.get_tree),
+]
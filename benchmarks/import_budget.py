@@ -0,0 +1,79 @@
+"""Check the cold start of the Streamlit apps.
+
+Imports what each app imports in a fresh interpreter, and fails when it
+takes longer than the budget or loads a dependency that should only be
+loaded on the code path that needs it (charts, PDFs, image processing and
+the GitHub client). Run from the repository root, with the app's Streamlit
+secrets readable::
+
+    python -m benchmarks.import_budget --budget-ms 1500
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ['main.py', 'management.py']
+DEFERRED = ['matplotlib', 'weasyprint', 'markdown', 'pandas', 'PIL', 'github', 'requests']
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def app_modules(app):
+    """Return the modules ``app`` imports at the top of the file, read from its source so the list can't go stale.
+
+    Imports inside functions are left out, they are what the app defers.
+    """
+    with open(os.path.join(ROOT, app), encoding='utf-8') as f:
+        tree = ast.parse(f.read(), app)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def measure(modules, runs=3):
+    """Return the best cold import time of ``modules`` over ``runs`` fresh interpreters, and the deferred modules loaded."""
+    best, loaded = None, []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _PROBE.format(modules=modules, deferred=DEFERRED)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result['ms'] < best:
+            best = result['ms']
+        loaded = result['loaded']
+    return best, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1500, help="cold import time allowed per app")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per app, the best one counts")
+    args = parser.parse_args()
+
+    failed = False
+    for app in APPS:
+        ms, loaded = measure(app_modules(app), args.runs)
+        over = ms > args.budget_ms
+        failed = failed or over or bool(loaded)
+        print(f"{app}: {ms:.0f} ms (budget {args.budget_ms:.0f} ms){' OVER BUDGET' if over else ''}")
+        if loaded:
+            print(f"  loads deferred dependencies at startup: {', '.join(loaded)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
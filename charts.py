@@ -0,0 +1,97 @@
+"""Charts of the reports, rendered as self-contained SVG.
+
+Charts are drawn with matplotlib's object-oriented API, which keeps no
+global state, in a pool of worker processes so the Streamlit thread never
+renders them. Each chart comes back as a data URI the report embeds, so a
+downloaded report needs no other file. The same numbers always give the
+same chart, so rendered charts are cached by their input.
+"""
+import base64
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import streamlit as st
+
+CHART_WORKERS = int(st.secrets.get("chart_workers", 2))  # Processes rendering charts
+CHART_CACHE_SIZE = 64  # Rendered charts kept in memory
+
+_pool = None
+_cache = OrderedDict()  # (chart function name, input) -> data URI
+_lock = threading.Lock()
+
+
+def _to_data_uri(figure):
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="svg")
+    return "data:image/svg+xml;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def pie_chart(departments, totals):
+    """Share of the requests of every department. Runs in a worker process."""
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 6))
+    ax = figure.subplots()
+    ax.pie(totals, labels=departments, autopct='%1.1f%%', startangle=90)
+    ax.axis('equal')
+    ax.set_ylabel('Total de Solicitudes')
+    ax.set_title('Total de Solicitudes por Departamento')
+    return _to_data_uri(figure)
+
+
+def bar_chart(departments, pending, posted):
+    """Pending and posted requests of every department. Runs in a worker process."""
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(12, 6))
+    ax = figure.subplots()
+    positions = range(len(departments))
+    ax.bar([x - 0.125 for x in positions], pending, width=0.25, label='Pendiente')
+    ax.bar([x + 0.125 for x in positions], posted, width=0.25, label='Publicada')
+    ax.set_title('Estado de Solicitudes por Departamento')
+    ax.set_xlabel('Departamento')
+    ax.set_ylabel('Cantidad de Solicitudes')
+    ax.set_xticks(list(positions))
+    ax.set_xticklabels(departments, rotation=45)
+    ax.legend(title='Estado de Solicitud')
+    figure.tight_layout()
+    return _to_data_uri(figure)
+
+
+def render(charts):
+    """Render ``charts``, a list of ``(function, args)``, in parallel and return their data URIs.
+
+    Charts already rendered with the same arguments come from the cache.
+    """
+    global _pool
+    keys = [(function.__name__, args) for function, args in charts]
+    results = {}
+    with _lock:
+        for key in keys:
+            if key in _cache:
+                _cache.move_to_end(key)
+                results[key] = _cache[key]
+        missing = [(key, function, args) for key, (function, args) in zip(keys, charts) if key not in results]
+        if missing and _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=CHART_WORKERS)
+        pool = _pool
+
+    try:
+        futures = {key: pool.submit(function, *args) for key, function, args in missing}
+        for key, future in futures.items():
+            results[key] = future.result()
+            with _lock:
+                _cache[key] = results[key]
+                while len(_cache) > CHART_CACHE_SIZE:
+                    _cache.popitem(last=False)
+    except BrokenProcessPool:
+        # A worker died; these charts fail, the next ones get a new pool
+        with _lock:
+            if _pool is pool:
+                _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    return [results[key] for key in keys]
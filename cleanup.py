@@ -0,0 +1,93 @@
+"""Attachment cleanup job.
+
+Deletes the attachments of posted requests in a single write, visiting only
+the requests that still have attachments. It runs on a background thread so
+the dashboard never waits for it, on a schedule when ``cleanup_interval``
+(hours) is set, or from the command line::
+
+    python cleanup.py --dry-run
+"""
+import argparse
+import threading
+import time
+
+import streamlit as st
+
+import telemetry
+from github_client import background
+from storage import get_store
+
+CLEANUP_INTERVAL = float(st.secrets.get("cleanup_interval", 0))  # Hours between scheduled runs, 0 disables them
+
+_lock = threading.Lock()
+_job = None
+_scheduler = None
+last_run = None  # {'dry_run', 'started', 'finished', 'results', 'reclaimed', 'error'} of the latest run
+
+
+def run(dry_run=False):
+    """Clean up now and return ``({code: error}, bytes reclaimed)``."""
+    global last_run
+    last_run = {'dry_run': dry_run, 'started': time.time(), 'finished': None,
+                'results': {}, 'reclaimed': 0, 'error': None}
+    try:
+        with background(), telemetry.span("cleanup.run"):
+            results, reclaimed = get_store().clean_attachments(dry_run=dry_run)
+    except Exception as e:
+        last_run.update(finished=time.time(), error=str(e))
+        raise
+    last_run.update(finished=time.time(), results=results, reclaimed=reclaimed)
+    return results, reclaimed
+
+
+def _run_logged(dry_run):
+    try:
+        results, reclaimed = run(dry_run)
+        print(f"Cleaned up {len(results)} requests, {reclaimed} bytes reclaimed")
+    except Exception as e:
+        print(f"Failed to clean up attachments: {str(e)}")
+
+
+def start(dry_run=False):
+    """Run a cleanup on a background thread; return False if one is already running."""
+    global _job
+    with _lock:
+        if _job is not None and _job.is_alive():
+            return False
+        _job = threading.Thread(target=_run_logged, args=(dry_run,), name="attachment-cleanup", daemon=True)
+        _job.start()
+        return True
+
+
+def _schedule():
+    while True:
+        time.sleep(CLEANUP_INTERVAL * 3600)
+        start()
+
+
+def start_scheduler():
+    """Start the scheduled cleanups of this process if ``cleanup_interval`` is set."""
+    global _scheduler
+    with _lock:
+        if CLEANUP_INTERVAL > 0 and (_scheduler is None or not _scheduler.is_alive()):
+            _scheduler = threading.Thread(target=_schedule, name="attachment-cleanup-scheduler", daemon=True)
+            _scheduler.start()
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    args = parser.parse_args()
+
+    results, reclaimed = run(args.dry_run)
+    for code, error in results.items():
+        print(f"{code}: {error or 'ok'}")
+    print(f"{'Would reclaim' if args.dry_run else 'Reclaimed'} {format_bytes(reclaimed)}")
@@ -0,0 +1,63 @@
+"""Process-wide cache for data loaded from the storage backend."""
+import threading
+import time
+
+
+class DataCache:
+    """Caches values for ``ttl`` seconds, then revalidates them with a cheap version check.
+
+    ``get`` only calls ``load`` when the version changed, so an unchanged
+    dataset is neither downloaded nor parsed again. Cached values are shared
+    between callers and must be treated as read-only.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> [version, value, checked_at]
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, version, load, revalidate=False):
+        """Return the value for ``key``.
+
+        ``version()`` returns the current version of the data and ``load(version)``
+        loads it; both are only called once the TTL has expired, or right away
+        with ``revalidate``.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry and not revalidate and now - entry[2] < self.ttl:
+                self.hits += 1
+                return entry[1]
+
+            current = version()
+            if entry and entry[0] == current:
+                self.revalidated += 1
+                entry[2] = now
+                return entry[1]
+
+            self.misses += 1
+            value = load(current)
+            self._entries[key] = [current, value, now]
+            return value
+
+    def invalidate(self, key=None):
+        """Forget ``key``, or everything, e.g. after writing to the backend."""
+        with self._lock:
+            self.invalidations += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
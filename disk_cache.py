@@ -0,0 +1,22 @@
+"""Least recently used eviction for the caches kept on disk (reports, snapshots).
+
+The modification time of a cached entry is its last use: it is touched
+every time the entry is served, and ``evict`` keeps only the most recently
+used entries.
+"""
+import os
+import shutil
+
+
+def touch(path):
+    """Mark the cached file or directory at ``path`` as just used."""
+    os.utime(path)
+
+
+def evict(paths, size):
+    """Delete every file or directory of ``paths`` but the ``size`` most recently used ones."""
+    for path in sorted(paths, key=os.path.getmtime, reverse=True)[size:]:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
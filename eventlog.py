@@ -0,0 +1,99 @@
+"""Append-only log of changes to the requests.
+
+Every write is one JSON line: a request was created, changed state, got
+more attachments or had its attachments cleaned. Readers fold the log on
+top of the last snapshot (the monthly partitions), and compaction folds it
+into a new snapshot so the log stays short.
+"""
+import json
+from datetime import datetime
+
+import states
+from request_index import TIMESTAMP_FORMAT, RequestIndex, plain_code
+
+CREATED = "created"
+STATE_CHANGED = "state_changed"
+ATTACHED = "attached"
+ATTACHMENTS_CLEANED = "attachments_cleaned"
+
+
+def created(request):
+    return {'event': CREATED, 'at': datetime.now().strftime(TIMESTAMP_FORMAT), 'request': request}
+
+
+def state_changed(code, state):
+    return {'event': STATE_CHANGED, 'at': datetime.now().strftime(TIMESTAMP_FORMAT),
+            'code': plain_code(code), 'state': state}
+
+
+def attached(code, images, files):
+    return {'event': ATTACHED, 'at': datetime.now().strftime(TIMESTAMP_FORMAT),
+            'code': plain_code(code), 'images': images, 'file': files}
+
+
+def attachments_cleaned(code):
+    return {'event': ATTACHMENTS_CLEANED, 'at': datetime.now().strftime(TIMESTAMP_FORMAT), 'code': plain_code(code)}
+
+
+def dumps(events):
+    """Serialize events as JSON lines."""
+    return "".join(json.dumps(event) + "\n" for event in events)
+
+
+def loads(text):
+    """Parse JSON lines, ignoring a torn last line."""
+    events = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except json.JSONDecodeError:
+            print(f"Skipping unreadable event: {line[:80]}")
+    return events
+
+
+def replay(snapshot, events):
+    """Fold ``events`` on top of the ``snapshot`` list of requests.
+
+    Returns a :class:`RequestIndex`, so every event touches exactly one
+    request in O(1). Creating a request whose id is already known is ignored,
+    which makes saving the same submission twice harmless. The index also
+    tracks the posted requests whose attachments can be cleaned up and the
+    monthly counts of the reports. The snapshot's requests are modified in
+    place.
+    """
+    index = RequestIndex(snapshot)
+    for request in index.requests:
+        _track_cleanup(index, request)
+
+    for event in events:
+        kind = event['event']
+        if kind == CREATED:
+            request = dict(event['request'])
+            if index.add(request):
+                _track_cleanup(index, request)
+            continue
+
+        request = index.get(event['code'])
+        if request is None:
+            continue
+        if kind == STATE_CHANGED:
+            index.set_state(request, event['state'])
+            if event['state'] == states.POSTED:
+                request['posted_timestamp'] = event['at']
+        elif kind == ATTACHED:
+            index.set_attachments(request, request['images'] + event['images'], request['file'] + event['file'])
+        elif kind == ATTACHMENTS_CLEANED:
+            index.set_attachments(request, [], [])
+        _track_cleanup(index, request)
+
+    return index
+
+
+def _track_cleanup(index, request):
+    """Keep ``index.pending_cleanup`` to the posted requests that still have attachments."""
+    if request['state'] == states.POSTED and (request['images'] or request['file']):
+        index.pending_cleanup.add(request['code'])
+    else:
+        index.pending_cleanup.discard(request['code'])
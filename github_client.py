@@ -0,0 +1,257 @@
+"""GitHub client shared by the whole process.
+
+Every module talks to the API through ``api_call``, which hands out a repo
+handle from a small pool of PyGithub clients (a PyGithub client can't be used
+by two threads at once, but each one keeps its HTTP connection alive between
+operations) and schedules the call within the hourly rate limit: background
+jobs leave ``BACKGROUND_RESERVE`` calls for interactive operations, and every
+caller backs off when GitHub starts throttling us.
+
+PyGithub and requests are imported on the first API call, so modules that
+only need ``background()`` don't load them.
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+import telemetry
+
+GITHUB_TOKEN = st.secrets.get("github_token")  # Use Streamlit secrets in production
+GITHUB_API_URL = st.secrets.get("github_api_url", "https://api.github.com")  # Overridden by the benchmarks
+REPO_NAME = "karendcl/fbio-web-requests"  # Your repo
+POOL_SIZE = int(st.secrets.get("github_pool_size", 8))  # Clients (and keep-alive connections) kept open
+BACKGROUND_RESERVE = int(st.secrets.get("github_background_reserve", 500))  # Calls background jobs leave untouched
+INTERACTIVE_MAX_WAIT = 30  # Seconds an interactive call waits for budget before giving up
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+
+class RateLimitScheduler:
+    """Keeps track of the remaining API budget and makes callers wait for it."""
+
+    def __init__(self, reserve):
+        self.reserve = reserve
+        self.remaining = None
+        self.limit = None
+        self.reset_at = 0
+        self.throttled = 0
+        self.waits = 0
+        self._failures = 0
+        self._paused_until = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, priority, cost=1):
+        """Block until ``cost`` calls fit in the budget left for ``priority``."""
+        deadline = time.time() + INTERACTIVE_MAX_WAIT
+        with self._cond:
+            while True:
+                now = time.time()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.remaining is None or now >= self.reset_at:
+                        # Unknown or freshly reset budget
+                        return
+                    available = self.remaining - (self.reserve if priority == BACKGROUND else 0)
+                    if available >= cost:
+                        self.remaining -= cost
+                        return
+                    wait = self.reset_at - now
+
+                if priority == INTERACTIVE and now + wait > deadline:
+                    raise RuntimeError(f"GitHub API rate limit exhausted until "
+                                       f"{time.strftime('%H:%M:%S', time.localtime(now + wait))}")
+                self.waits += 1
+                self._cond.wait(min(wait, 60))
+
+    def observe(self, remaining, limit, reset_at):
+        """Record the budget GitHub reported in its last response."""
+        if remaining < 0:
+            return
+        with self._cond:
+            self.remaining, self.limit, self.reset_at = remaining, limit, reset_at
+            self._cond.notify_all()
+
+    def observe_headers(self, headers):
+        if "X-RateLimit-Remaining" in headers:
+            self.observe(int(float(headers["X-RateLimit-Remaining"])), int(float(headers.get("X-RateLimit-Limit", -1))),
+                         int(float(headers.get("X-RateLimit-Reset", 0))))
+
+    def succeeded(self):
+        with self._cond:
+            self._failures = 0
+
+    def backoff(self, retry_after=None):
+        """Pause every caller after GitHub throttled us, for longer each time it happens in a row."""
+        with self._cond:
+            self._failures += 1
+            self.throttled += 1
+            delay = retry_after if retry_after else min(2 ** self._failures, 300)
+            self._paused_until = max(self._paused_until, time.time() + delay)
+
+    def stats(self):
+        return {
+            'remaining': self.remaining,
+            'limit': self.limit,
+            'reset_at': self.reset_at,
+            'throttled': self.throttled,
+            'waits': self.waits,
+        }
+
+
+scheduler = RateLimitScheduler(BACKGROUND_RESERVE)
+
+_local = threading.local()
+_clients = queue.LifoQueue()
+_clients_lock = threading.Lock()
+_created = 0
+_session = None
+_etags = {}  # url -> (ETag, payload)
+
+
+def current_priority():
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """Run the API calls made inside the block, on this thread, as background work."""
+    previous = current_priority()
+    _local.priority = BACKGROUND
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def _get_session():
+    global _session
+    with _clients_lock:
+        if _session is None:
+            import requests
+            _session = requests.Session()
+            for prefix in ("https://", "http://"):
+                _session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE,
+                                                                     pool_maxsize=POOL_SIZE))
+    return _session
+
+
+def _checkout():
+    global _created
+    try:
+        return _clients.get_nowait()
+    except queue.Empty:
+        pass
+    with _clients_lock:
+        if _created < POOL_SIZE:
+            _created += 1
+            from github import Github
+            # Reads aren't spaced out by PyGithub, the scheduler backs off when GitHub throttles us
+            github = Github(GITHUB_TOKEN, base_url=GITHUB_API_URL, pool_size=POOL_SIZE, seconds_between_requests=None)
+            # lazy: the repo is addressed by name, without an API call to fetch it
+            repo = github.get_repo(REPO_NAME, lazy=True)
+            _count_requests(repo.requester)
+            return github, repo
+    return _clients.get()
+
+
+def _count_requests(requester):
+    """Count every HTTP request made through ``requester`` as ``github_requests``.
+
+    PyGithub calls ``DEBUG_ON_RESPONSE`` once per response, whatever the
+    call, so it is wrapped rather than trusting the cost callers declare.
+    """
+    on_response = requester.DEBUG_ON_RESPONSE
+
+    def counted(status, headers, data):
+        telemetry.count("github_requests")
+        on_response(status, headers, data)
+
+    requester.DEBUG_ON_RESPONSE = counted
+
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    return float(value) if value else None
+
+
+def _is_throttled(error):
+    from github import RateLimitExceededException
+    if isinstance(error, RateLimitExceededException):
+        return True
+    return error.status in (403, 429) and "rate limit" in str(error).lower()
+
+
+@contextmanager
+def api_call(cost=1, priority=None, name="call"):
+    """Yield the shared repo handle for an operation making about ``cost`` API calls.
+
+    ``cost`` is only what is reserved from the rate limit; the requests
+    actually made are counted as ``github_requests``. The operation is
+    timed as the ``github.<name>`` span.
+    """
+    from github import GithubException
+    scheduler.acquire(priority or current_priority(), cost)
+    github, repo = _checkout()
+    try:
+        with telemetry.span(f"github.{name}"):
+            yield repo
+    except GithubException as e:
+        if _is_throttled(e):
+            scheduler.backoff(_retry_after(e))
+        raise
+    else:
+        scheduler.succeeded()
+    finally:
+        # Read what the last response reported; github.rate_limiting would make a call when unknown.
+        # The lazy repo has a requester of its own, which is the one that made the calls.
+        remaining, limit = repo.requester.rate_limiting
+        scheduler.observe(remaining, limit, repo.requester.rate_limiting_resettime)
+        _clients.put((github, repo))
+
+
+def repo_api_url(path):
+    return f"{GITHUB_API_URL}/repos/{REPO_NAME}/{path}"
+
+
+def conditional_get(url, priority=None):
+    """GET a GitHub API url, answering from memory when GitHub says it didn't change.
+
+    Uses ``If-None-Match`` with the last ETag; 304 answers don't count against the rate limit.
+    """
+    headers = {"Authorization": f"token {GITHUB_TOKEN}", "Accept": "application/vnd.github+json"}
+    cached = _etags.get(url)
+    if cached:
+        headers["If-None-Match"] = cached[0]
+    scheduler.acquire(priority or current_priority())
+    telemetry.count("github_requests")
+    with telemetry.span("github.conditional_get"):
+        response = _get_session().get(url, headers=headers, timeout=30)
+    scheduler.observe_headers(response.headers)
+    telemetry.count("github_bytes_received", len(response.content))
+    if response.status_code == 304:
+        telemetry.count("github_not_modified")
+        return cached[1]
+    if response.status_code in (403, 429) and response.headers.get("X-RateLimit-Remaining") == "0":
+        scheduler.backoff(float(response.headers.get("Retry-After", 0)) or None)
+    response.raise_for_status()
+    payload = response.json()
+    if response.headers.get("ETag"):
+        _etags[url] = (response.headers["ETag"], payload)
+    return payload
+
+
+def reset(base_url=None):
+    """Drop the pooled clients, optionally pointing new ones at another API url."""
+    global GITHUB_API_URL, _created
+    with _clients_lock:
+        if base_url:
+            GITHUB_API_URL = base_url
+        while not _clients.empty():
+            _clients.get_nowait()
+        _created = 0
+        _etags.clear()
@@ -0,0 +1,92 @@
+"""Shrinks uploaded photos before they are saved.
+
+Every image is downscaled to ``IMAGE_MAX_SIZE``, recompressed and stripped
+of its EXIF data (after applying its orientation), and gets a small JPEG
+thumbnail for the dashboard. Images are processed in a pool of worker
+processes, and the results are written next to the upload following the
+naming of ``attachment_store.thumbnail_path`` and ``original_path``.
+"""
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import streamlit as st
+from PIL import Image, ImageOps
+
+import attachment_store
+
+IMAGE_MAX_SIZE = int(st.secrets.get("image_max_size", 2048))  # Longest side, in pixels, of a saved image
+IMAGE_QUALITY = int(st.secrets.get("image_quality", 85))  # JPEG quality of the recompressed images
+THUMBNAIL_SIZE = int(st.secrets.get("thumbnail_size", 320))  # Longest side, in pixels, of a thumbnail
+KEEP_ORIGINALS = bool(st.secrets.get("keep_original_images", False))  # Also save the images as uploaded
+IMAGE_WORKERS = int(st.secrets.get("image_workers", os.cpu_count() or 1))  # Processes optimizing images
+
+_pool = None
+
+
+def _save(image, path, image_format):
+    if image_format == "JPEG":
+        image.convert("RGB").save(path, "JPEG", quality=IMAGE_QUALITY, optimize=True, progressive=True)
+    else:
+        # Saving without passing exif drops it
+        image.save(path, image_format, optimize=True)
+
+
+def optimize(path, max_size=IMAGE_MAX_SIZE, thumbnail_size=THUMBNAIL_SIZE, keep_original=KEEP_ORIGINALS):
+    """Optimize the image at ``path`` in place and write its thumbnail. Runs in a worker process."""
+    original = attachment_store.original_path(path)
+    # An original kept by an earlier attempt is the real upload, ``path`` may be optimized already
+    if keep_original and not os.path.exists(original):
+        shutil.copyfile(path, original)
+
+    with Image.open(path) as image:
+        image_format = image.format
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        # Replace the upload only once the optimized copy is complete
+        _save(image, path + ".tmp", image_format)
+        os.replace(path + ".tmp", path)
+
+        image.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+        _save(image, attachment_store.thumbnail_path(path), "JPEG")
+    return path
+
+
+def _discard(pool):
+    """Forget ``pool`` once one of its workers died, so the next images get a new one."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def optimize_images(paths):
+    """Optimize every image in ``paths`` in parallel.
+
+    An image that can't be processed is kept as uploaded. A worker that
+    dies, e.g. killed for running out of memory on a huge photo, breaks the
+    pool; the images still in it are kept as uploaded too and the pool is
+    started again for the next ones.
+    """
+    global _pool
+    if not paths:
+        return
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    pool = _pool
+    futures = {}
+    try:
+        for path in paths:
+            futures[path] = pool.submit(optimize, path, IMAGE_MAX_SIZE, THUMBNAIL_SIZE, KEEP_ORIGINALS)
+    except BrokenProcessPool as e:
+        print(f"Image workers stopped, keeping {len(paths) - len(futures)} images as uploaded: {str(e)}")
+        _discard(pool)
+    for path, future in futures.items():
+        try:
+            future.result()
+        except BrokenProcessPool as e:
+            print(f"Image workers stopped while optimizing {path}, keeping it as uploaded: {str(e)}")
+            _discard(pool)
+        except Exception as e:
+            print(f"Failed to optimize image {path}, keeping it as uploaded: {str(e)}")
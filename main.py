@@ -1,9 +1,16 @@
 import streamlit as st
+
+import telemetry
 from model import WebPostRequest
+from submission_queue import start_writer, status
 
 def main():
     st.title("Petición sobre publicación en página web")
 
+    # Save whatever was left in the spool by a previous run
+    start_writer()
+    telemetry.start_exporter()
+
     with st.form(key='post_request_form', clear_on_submit=True, enter_to_submit=False):
         user_name = st.text_input("Nombre")
         user_email = st.text_input("Email")
@@ -24,25 +31,44 @@ def main():
 
         if submit_button:
             try:
-                image_paths = []
-                for image in images:
-                    image_path = f"data/{image.name}"
-                    with open(image_path, "wb") as f:
-                        f.write(image.getbuffer())
-                    image_paths.append(image_path)
-                file_paths = []
-                for file in files:
-                    file_path = f"data/{file.name}"
-                    with open(file_path, "wb") as f:
-                        f.write(file.getbuffer())
-                    file_paths.append(file_path)
-                WebPostRequest(user_name, user_email, topic, message, image_paths, department, file_paths)
+                # The uploads are streamed into the submission spool, without a copy in data/
+                progress_bar = st.progress(0.0, text="Enviando adjuntos...")
+                request = WebPostRequest(user_name, user_email, topic, message, list(images), department, list(files),
+                                         progress=lambda done, total: progress_bar.progress(
+                                             done / total, text=f"Enviando adjuntos ({done}/{total})..."))
+                progress_bar.empty()
+                st.session_state['ticket'] = request.ticket
                 st.success("Su peticion ha sido enviada con exito. Se le notificará por correo electrónico cuando su publicación sea aprobada. Gracias por su paciencia. ")
                 st.balloons()
             except Exception as e:
                 st.error(f"Ocurrio un error: {e}."
                          f"Intentelo de nuevo, o si no lo puede solucionar pongase en contacto con el administrador del sistema.")
 
+    if 'ticket' in st.session_state:
+        show_upload_status(st.session_state['ticket'])
+
+
+def show_upload_status(ticket):
+    """Show how far the attachments of the last submission got on their way to storage."""
+    current = status(ticket)
+    if current['saved']:
+        st.info("Su petición y sus adjuntos fueron guardados.")
+        return
+    if current['given_up']:
+        for name, error in current['failed'].items():
+            st.error(f"No se pudo guardar {name}: {error}.")
+        st.error("No se pudo guardar su petición después de varios intentos. "
+                 "Póngase en contacto con el administrador del sistema.")
+        return
+    if current['total']:
+        st.progress(current['uploaded'] / current['total'],
+                    text=f"Guardando adjuntos ({current['uploaded']}/{current['total']})...")
+    else:
+        st.info("Su petición está en cola para ser guardada.")
+    for name, error in current['failed'].items():
+        st.warning(f"No se pudo guardar {name}: {error}. Se volverá a intentar automáticamente.")
+    st.button("Actualizar estado")
+
 
 if __name__ == "__main__":
     main()
@@ -1,24 +1,21 @@
-import json
 import os
 
 import streamlit as st
-import pandas as pd
 from datetime import datetime
 
-from github import Github
-
+import cleanup
+import github_client
+import pdf_export
 import states
+import telemetry
 from model import WebPostRequest
-from reports import get_statistics
+from storage import get_store
 
 # MUST be first command
 st.set_page_config(layout="wide")
 
-REPO_URL = "https://raw.githubusercontent.com/karendcl/fbio-web-requests/main/"
-GITHUB_TOKEN = st.secrets["github_token"]  # Use Streamlit secrets in production
-REPO_NAME = "karendcl/fbio-web-requests"  # Your repo
-FILE_PATH = "data.json"  # Path to your JSON file
-BRANCH = "main"  # Branch to update
+PAGE_SIZE = int(st.secrets.get("page_size", 25))  # Requests shown per page by default
+PAGE_SIZES = [10, 25, 50, 100]
 
 def generate_email_content(row):
     """Generate email content for the request."""
@@ -59,126 +56,135 @@ def post_administrative_task(topic, message):
 def request_posted(row):
     """Update the status of the request to 'posted'.
     """
-    g = Github(GITHUB_TOKEN)
-    repo = g.get_repo(REPO_NAME)
-
-    # Get current JSON file
-    file = repo.get_contents(FILE_PATH, ref=BRANCH)
-    sha = file.sha
-    current_data = json.loads(file.decoded_content.decode())
-
-    # Update the status of the request
-    for request in current_data:
-        if request['user_name'] == row['user_name'] and \
-                request['topic'] == row['topic'] and \
-                request['department'] == row['department'] and \
-                request['message'] == row['message']:
-            request['state'] = 'posted'
-            request['posted_timestamp'] = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    # Save the updated JSON file
-    repo.update_file(
-        path=FILE_PATH,
-        message="Update request status to posted",
-        content=json.dumps(current_data, indent=4),
-        sha=sha,
-        branch=BRANCH
-    )
+    get_store().update_state(row['code'], states.POSTED)
 
 def action_to_clean_images_and_files():
-    """Clean up images and files from the request."""
-    g = Github(GITHUB_TOKEN)
-    repo = g.get_repo(REPO_NAME)
-
-    # Get current JSON file
-    file = repo.get_contents(FILE_PATH, ref=BRANCH)
-    sha = file.sha
-    current_data = json.loads(file.decoded_content.decode())
-
-    # Clean up images and files
-    for request in current_data:
-        if request['state'] == 'posted':
-            for img_path in request['images']:
-                try:
-                    # Get the SHA of the file to delete
-                    img_name1 = img_path[5:]
-                    img_path = f"data/{img_name1}"
-                    shai = repo.get_contents(img_path, ref=BRANCH).sha
-                    repo.delete_file(
-                        path=img_path,
-                        message=f"Delete image {img_path}",
-                        sha=shai,
-                        branch=BRANCH
-                    )
-                except Exception as e:
-                    print(f"Failed to delete image {img_path}: {str(e)}")
-            for img_path in request['file']:
-                try:
-                    # Get the SHA of the file to delete
-                    img_name1 = img_path[5:]
-                    img_path = f"data/{img_name1}"
-                    shai = repo.get_contents(img_path, ref=BRANCH).sha
-                    repo.delete_file(
-                        path=img_path,
-                        message=f"Delete file {img_path}",
-                        sha=shai,
-                        branch=BRANCH
-                    )
-                except Exception as e:
-                    print(f"Failed to delete file {img_path}: {str(e)}")
-
-
-            request['images'] = []
-            request['file'] = []
-
-    # Save the updated JSON file
-    repo.update_file(
-        path=FILE_PATH,
-        message="Clean up images and files",
-        content=json.dumps(current_data, indent=4),
-        sha=sha,
-        branch=BRANCH
-    )
-
-
-def load_data():
-    try:
-        response = pd.read_json(REPO_URL + 'data.json')
-        # Convert timestamp to datetime if it exists
-        if 'timestamp' in response.columns:
-            response['timestamp'] = pd.to_datetime(response['timestamp'])
-        return response.to_dict('records')
-    except Exception as e:
-        st.error(f"Error loading data: {e}")
-        return []
-
-
-def get_dataframe():
-    # Load data
-    data = load_data()
-
-    if not data:
-        st.warning("No data found or couldn't load data.")
-        return
+    """Clean up images and files from posted requests on a background thread."""
+    return cleanup.start()
+
+
+def show_results(results, labels, success):
+    """Report the outcome of a bulk action for every selected request."""
+    for code, error in results.items():
+        if error is None:
+            st.success(f"{labels[code]}: {success}")
+        else:
+            st.error(f"{labels[code]}: {error}")
+
+
+def render_attachment_link(path, label, key):
+    """Show a download link for an attachment, or a download button if it is only stored locally."""
+    url = get_store().attachment_url(path)
+    if url:
+        st.markdown(f"[{label}]({url})", unsafe_allow_html=True)
+    elif os.path.exists(path):
+        with open(path, "rb") as attachment:
+            st.download_button(label=label, data=attachment.read(), file_name=os.path.basename(path), key=key)
+    else:
+        st.write(f"{label} (not available)")
+
+
+def render_request(request):
+    """Show the details, attachments and actions of a request; only called for opened rows."""
+    code = request['code']
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("User Info")
+        st.write(f"**Name:** {request.get('user_name', 'N/A')}")
+        st.write(f"**Email:** {request.get('user_email', 'N/A')}")
+        st.write(f"**Department:** {request.get('department', 'N/A')}")
+
+    with col2:
+        st.subheader("Request Info")
+        st.write(f"**Topic:** {request.get('topic', 'N/A')}")
+        st.write(f"**Message:** {request.get('message', 'N/A')}")
+
+    if request.get('images'):
+        st.subheader(f"Attached Images ({len(request['images'])})")
+        cols = st.columns(min(3, len(request['images'])))
+        for i, img_url in enumerate(request['images']):
+            with cols[i % 3]:
+                thumbnail = get_store().thumbnail(img_url)
+                if thumbnail:
+                    st.image(thumbnail)
+                render_attachment_link(img_url, f"Download Image {i}", key=f"images_{code}_{i}")
+
+    if request.get('file'):
+        st.subheader(f"Attached Files ({len(request['file'])})")
+        cols = st.columns(min(3, len(request['file'])))
+        for i, img_url in enumerate(request['file']):
+            with cols[i % 3]:
+                render_attachment_link(img_url, f"Download File {i}", key=f"file_{code}_{i}")
+
+    # Action buttons
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Posted", key=f"approve_{code}"):
+            request_posted(request)
+            st.success("Request marked as posted.")
+    with col2:
+        if st.button("Generate Email", key=f"email_{code}"):
+            email_content = generate_email_content(request)
+            st.subheader("Email Content")
+            st.code(email_content, language="markdown")
+
+            st.success("Email generated successfully.")
+
+
+def show_system_health():
+    """Show the latencies and counters this dashboard's process recorded since it started."""
+    spans = telemetry.spans()
+    if spans:
+        st.table([{'Stage': name, 'Calls': stats['count'], 'Errors': stats['errors'],
+                   'p50 (ms)': round(stats['p50'] * 1000), 'p95 (ms)': round(stats['p95'] * 1000)}
+                  for name, stats in spans.items()])
+    else:
+        st.caption("Nothing measured yet.")
+    counters = telemetry.counters()
+    if counters:
+        st.caption(", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in counters.items()))
+    rate = github_client.scheduler.stats()
+    if rate['remaining'] is not None:
+        st.caption(f"GitHub rate limit: {rate['remaining']}/{rate['limit']} calls left, "
+                   f"throttled {rate['throttled']} times")
+    st.download_button("Download metrics", data=telemetry.prometheus(), file_name="metrics.txt",
+                       mime="text/plain", help="Prometheus text format")
+
+
+def show_pdf_export(job_id):
+    """Show how the last PDF export is going, and offer the PDF once it is ready."""
+    current = pdf_export.status(job_id)
+    if current['state'] == pdf_export.DONE:
+        with open(current['path'], "rb") as file:
+            st.download_button(label="Download PDF", data=file.read(), file_name=os.path.basename(current['path']),
+                               mime="application/pdf", icon="📥")
+    elif current['state'] == pdf_export.FAILED:
+        st.error(f"PDF export failed: {current['error']}")
+    else:
+        st.info("The PDF is being generated...")
+        st.button("Refresh PDF status")
 
-    df = pd.DataFrame(data)
-
-    return df
 
 def main():
     st.title("📊 Web Request Dashboard")
-
-    df = get_dataframe()
+    cleanup.start_scheduler()
+    telemetry.start_exporter()
+    store = get_store()
 
     # Sidebar filters and sorting
     with st.sidebar:
         st.header("Filters & Sorting")
 
-        # Sorting options
+        search = st.text_input("Search", placeholder="Topic, message, name or email",
+                               help="Finds the requests containing every word, ignoring case and accents")
+
+        # Sorting options: (key, descending)
         sort_options = {
-            "Name (A-Z)": "name_asc",
-            "Name (Z-A)": "name_desc",
-            "Status": "status"
+            "Name (A-Z)": ('user_name', False),
+            "Name (Z-A)": ('user_name', True),
+            "Status": ('state', False),
+            "Newest first": ('timestamp', True),
+            "Oldest first": ('timestamp', False),
         }
         selected_sort = st.selectbox(
             "Sort By",
@@ -187,7 +193,7 @@ def main():
         )
 
         # Status filter
-        status_options = ["All"] + list(df['state'].unique())
+        status_options = ["All", states.PENDING, states.POSTED, states.APPROVED_BY_USER]
         selected_status = st.selectbox(
             "Status",
             options=status_options,
@@ -195,21 +201,37 @@ def main():
         )
 
         # Department filter
-        department_options = ["All"] + list(df['department'].unique())
+        department_options = ["All"] + store.list_departments()
         selected_department = st.selectbox(
             "Department",
             options=department_options,
             index=0
         )
 
+        page_size = st.selectbox("Requests per page", options=PAGE_SIZES,
+                                 index=PAGE_SIZES.index(PAGE_SIZE) if PAGE_SIZE in PAGE_SIZES else 0)
+
         st.divider()
 
         st.header("Actions")
         if st.button("Clean Up Images and Files", icon="🧹", help="Clean up images and files from posted requests"):
-            action_to_clean_images_and_files()
-            st.success("Images and files cleaned up successfully.")
+            if action_to_clean_images_and_files():
+                st.success("Cleanup started, images and files are being removed in the background.")
+            else:
+                st.info("A cleanup is already running.")
+        if st.button("Preview Clean Up", help="Show how much space the clean up would free, without deleting anything"):
+            results, reclaimed = get_store().clean_attachments(dry_run=True)
+            st.info(f"Cleaning up {len(results)} requests would free {cleanup.format_bytes(reclaimed)}.")
+        if cleanup.last_run and cleanup.last_run['finished']:
+            if cleanup.last_run['error']:
+                st.caption(f"Last clean up failed: {cleanup.last_run['error']}")
+            elif not cleanup.last_run['dry_run']:
+                st.caption(f"Last clean up: {len(cleanup.last_run['results'])} requests, "
+                           f"{cleanup.format_bytes(cleanup.last_run['reclaimed'])} freed")
 
         if st.button("Generate Monthly Report", icon="📊", help="Generate the monthly report"):
+            # pandas and matplotlib are only loaded when a report is generated
+            from reports import get_statistics
             path, message = get_statistics(year=datetime.now().year, month=datetime.now().month)
             if path:
                 st.success(f"Report generated successfully")
@@ -232,6 +254,20 @@ def main():
             else:
                 st.error(f"Failed: {message}")
 
+        if st.button("Export Monthly Report as PDF", icon="🖨️",
+                     help="Generate the monthly report as PDF in the background"):
+            st.session_state['pdf_job'] = pdf_export.start(year=datetime.now().year, month=datetime.now().month)
+        if 'pdf_job' in st.session_state:
+            show_pdf_export(st.session_state['pdf_job'])
+
+        cache_stats = get_store().cache_stats()
+        if cache_stats:
+            st.caption(f"Data cache: {cache_stats['hits'] + cache_stats['revalidated']} hits "
+                       f"({cache_stats['revalidated']} revalidated), {cache_stats['misses']} misses")
+
+        with st.expander("System health"):
+            show_system_health()
+
         st.divider()
         st.header("Post Administrative Task")
 
@@ -242,92 +278,61 @@ def main():
                                                   help="Post an administrative task")
 
             if submit_button:
-                print(topic, message)
                 post_administrative_task(topic, message)
                 st.success("Administrative task posted successfully.")
 
-    # Apply filters
-    filtered_df = df.copy()
-    if selected_status != "All":
-        filtered_df = filtered_df[filtered_df['state'] == selected_status]
-    if selected_department != "All":
-        filtered_df = filtered_df[filtered_df['department'] == selected_department]
-
-    # Apply sorting
-    if sort_options[selected_sort] == "timestamp_desc":
-        if 'timestamp' in filtered_df.columns:
-            filtered_df = filtered_df.sort_values('timestamp', ascending=False)
-    elif sort_options[selected_sort] == "timestamp_asc":
-        if 'timestamp' in filtered_df.columns:
-            filtered_df = filtered_df.sort_values('timestamp', ascending=True)
-    elif sort_options[selected_sort] == "name_asc":
-        filtered_df = filtered_df.sort_values('user_name', ascending=True)
-    elif sort_options[selected_sort] == "name_desc":
-        filtered_df = filtered_df.sort_values('user_name', ascending=False)
-    elif sort_options[selected_sort] == "status":
-        filtered_df = filtered_df.sort_values('state')
+    # Filtering, sorting and paging happen in the store; only one page of requests is loaded
+    filters = {'state': None if selected_status == "All" else selected_status,
+               'department': None if selected_department == "All" else selected_department,
+               'query': search or None}
+    total = store.count_requests(**filters)
+    if not total:
+        st.warning("No requests match the filters." if any(filters.values()) else "No data found or couldn't load data.")
+        return
 
     # Display metrics
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Requests", len(filtered_df))
-    col2.metric("Pending", len(filtered_df[filtered_df['state'] == 'pending']))
-    col3.metric("Completed", len(filtered_df[filtered_df['state'] == 'posted']))
-
-    # Display data with action buttons
-    for row_index, row in filtered_df.iterrows():
-        with st.expander(f"{row.get('user_name', 'N/A')} ({row.get('user_email','N/A')}) - {row.get('state', 'N/A')} ",
-                         expanded=False):
-            col1, col2 = st.columns(2)
-            with col1:
-                st.subheader("User Info")
-                st.write(f"**Name:** {row.get('user_name', 'N/A')}")
-                st.write(f"**Email:** {row.get('user_email', 'N/A')}")
-                st.write(f"**Department:** {row.get('department', 'N/A')}")
-
-            with col2:
-                st.subheader("Request Info")
-                st.write(f"**Topic:** {row.get('topic', 'N/A')}")
-                st.write(f"**Message:** {row.get('message', 'N/A')}")
-
-            if 'images' in row and row['images']:
-                st.subheader(f"Attached Images ({len(row['images'])})")
-                cols = st.columns(min(3, len(row['images'])))
-                for i, img_url in enumerate(row['images']):
-                    with cols[i % 3]:
-                        path = REPO_URL + img_url
-                        path = path.replace(' ', '%20')
-
-                        st.markdown(f"[Download Image {i}]({path})", unsafe_allow_html=True)
-
-            if 'file' in row and row['file']:
-                st.subheader(f"Attached Files ({len(row['file'])})")
-                cols = st.columns(min(3, len(row['file'])))
-                for i, img_url in enumerate(row['file']):
-                    with cols[i % 3]:
-                        path = REPO_URL + img_url
-                        path = path.replace(' ', '%20')
-
-                        st.markdown(f"[Download File {i}]({path})", unsafe_allow_html=True)
-
-            # Action buttons
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("Posted", key=f"approve_{row_index}"):
-                    request_posted(row)
-                    st.success("Request marked as posted.")
-            with col2:
-                if st.button("Generate Email", key=f"email_{row_index}"):
-                    email_content = generate_email_content(row)
-                    st.subheader("Email Content")
-                    st.code(email_content, language="markdown")
-
-                    st.success("Email generated successfully.")
-
-
-
-
-
-
+    col1.metric("Total Requests", total)
+    col2.metric("Pending", total if filters['state'] == states.PENDING else
+                0 if filters['state'] else store.count_requests(states.PENDING, filters['department'], query=filters['query']))
+    col3.metric("Completed", total if filters['state'] == states.POSTED else
+                0 if filters['state'] else store.count_requests(states.POSTED, filters['department'], query=filters['query']))
+
+    pages = (total + page_size - 1) // page_size
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1)
+    order_by, descending = sort_options[selected_sort]
+    requests = store.list_requests(**filters, order_by=order_by, descending=descending,
+                                   limit=page_size, offset=(page - 1) * page_size)
+
+    # Bulk actions on the selected requests of this page, each saved in a single write
+    labels = {request['code']: f"{request.get('user_name', 'N/A')} - {request.get('topic', 'N/A')} "
+                               f"({request.get('state', 'N/A')})"
+              for request in requests}
+    selected_codes = st.multiselect("Select requests", options=list(labels), format_func=labels.get)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("Mark Selected as Posted", disabled=not selected_codes):
+            show_results(store.update_states(selected_codes, states.POSTED), labels,
+                         "marked as posted.")
+    with col2:
+        generate_emails = st.button("Generate Selected Emails", disabled=not selected_codes)
+    with col3:
+        if st.button("Clean Up Selected Attachments", disabled=not selected_codes):
+            results, reclaimed = store.clean_attachments(selected_codes)
+            show_results(results, labels, "images and files cleaned up.")
+            st.info(f"{cleanup.format_bytes(reclaimed)} freed.")
+    if generate_emails:
+        by_code = {request['code']: request for request in requests}
+        for code in selected_codes:
+            st.subheader(f"Email for {labels[code]}")
+            st.code(generate_email_content(by_code[code]), language="markdown")
+
+    # One toggle per request; details, attachments and buttons are only built for the opened ones
+    for request in requests:
+        if st.toggle(f"{request.get('user_name', 'N/A')} ({request.get('user_email', 'N/A')}) - "
+                     f"{request.get('state', 'N/A')}", key=f"open_{request['code']}"):
+            with st.container(border=True):
+                render_request(request)
 
 
 if __name__ == "__main__":
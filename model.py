@@ -1,6 +1,7 @@
 
 import states
-import automation
+import submission_queue
+from request_index import TIMESTAMP_FORMAT, request_code
 from datetime import datetime
 
 class WebPostRequest:
@@ -12,7 +13,8 @@ class WebPostRequest:
                  images,
                  department,
                  file,
-                 state = states.PENDING):
+                 state = states.PENDING,
+                 progress=None):
         self.user_name = user_name
         self.user_email = user_email
         self.topic = topic
@@ -21,12 +23,13 @@ class WebPostRequest:
         self.file = file
         self.state = state
         self.department = department
-        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.code = hash(f"{self.user_name}{self.topic}{self.department}{self.message}")
+        self.timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        self.code = request_code(vars(self))
 
-        self.save_to_json()
+        self.ticket = self.save_to_json(progress)
 
-    def save_to_json(self):
+    def save_to_json(self, progress=None):
+        """Queue the request to be saved and return its ticket in the submission spool."""
 
         new_data = {
             'code': self.code,
@@ -41,6 +44,6 @@ class WebPostRequest:
             'timestamp': self.timestamp
         }
 
-        automation.update_json(new_data=new_data)
+        return submission_queue.enqueue(new_data, progress)
 
 
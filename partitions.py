@@ -0,0 +1,104 @@
+"""Monthly partitions of the requests on the GitHub repo.
+
+Requests are stored by the month they were submitted in, as
+``data/<year>/<month>.json``, so compacting the event log rewrites only the
+months it touched, usually the current one. ``data/manifest.json`` lists
+every partition with its path, its number of requests, how many of them are
+not posted yet, their counts by department, user and state (see
+``aggregates.count_rows``) and the git blob sha of its contents. Readers
+compare the shas to download and parse again only the partitions that
+changed, and take the counts of the months they don't need from the
+manifest instead of downloading them.
+
+Once a month is ``ARCHIVE_AFTER`` months old and every request in it is
+posted it won't change anymore, so it is archived gzip-compressed as
+``data/<year>/<month>.json.gz``. Archived partitions are read like the
+others.
+"""
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+import streamlit as st
+
+import states
+from aggregates import count_rows, month_of
+
+DATA_DIR = "data"  # Where the partitions live in the GitHub repo
+MANIFEST_PATH = f"{DATA_DIR}/manifest.json"
+ARCHIVE_AFTER = int(st.secrets.get("archive_after_months", 12))  # Months before a fully posted month is archived
+
+
+def partition_path(month, archived=False):
+    """Return the path of the partition of ``month`` (``YYYYMM``)."""
+    return f"{DATA_DIR}/{month[:4]}/{month[4:]}.json" + (".gz" if archived else "")
+
+
+def blob_sha(content):
+    """Return the git blob sha of ``content`` (str or bytes), as GitHub will report it."""
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.sha1(f"blob {len(content)}\0".encode() + content).hexdigest()
+
+
+def split(requests):
+    """Group ``requests`` by month, keeping their order: ``{month: [requests]}``."""
+    months = {}
+    for request in requests:
+        months.setdefault(month_of(request), []).append(request)
+    return months
+
+
+def encode(requests, archived=False):
+    """Serialize a partition: text, or gzip-compressed bytes once archived."""
+    content = json.dumps(requests, indent=4)
+    # No timestamp in the gzip header, so the same requests always give the same blob
+    return gzip.compress(content.encode(), mtime=0) if archived else content
+
+
+def decode(content, path):
+    """Parse a partition read from ``path`` (bytes)."""
+    if path.endswith(".gz"):
+        content = gzip.decompress(content)
+    return json.loads(content) if content else []
+
+
+def should_archive(month, requests, today=None):
+    """Whether ``month`` is old enough and every request in it posted."""
+    today = today or datetime.now()
+    age = today.year * 12 + today.month - (int(month[:4]) * 12 + int(month[4:]))
+    return age >= ARCHIVE_AFTER and all(request['state'] == states.POSTED for request in requests)
+
+
+def archivable(manifest, today=None):
+    """Return the months of ``manifest`` that should be archived but aren't yet."""
+    today = today or datetime.now()
+    return [month for month, entry in manifest.items()
+            if not entry['archived'] and entry['pending'] == 0 and should_archive(month, [], today)]
+
+
+def write(months, manifest, today=None):
+    """Serialize the partitions of ``months`` (``{month: [requests]}``) and update ``manifest`` in place.
+
+    Returns ``(files, deletions)``: ``{path: content}`` of the partitions that
+    changed plus the manifest, and the paths of partitions that moved, such
+    as the plain copy of a partition that was just archived.
+    """
+    files = {}
+    deletions = []
+    for month, requests in sorted(months.items()):
+        archived = should_archive(month, requests, today)
+        content = encode(requests, archived)
+        entry = {'path': partition_path(month, archived), 'archived': archived, 'count': len(requests),
+                 'pending': sum(request['state'] != states.POSTED for request in requests),
+                 'counts': count_rows(requests), 'sha': blob_sha(content)}
+        previous = manifest.get(month)
+        if previous == entry:
+            continue
+        if previous and previous['path'] != entry['path']:
+            deletions.append(previous['path'])
+        files[entry['path']] = content
+        manifest[month] = entry
+    files[MANIFEST_PATH] = json.dumps(dict(sorted(manifest.items())), indent=4)
+    return files, deletions
@@ -0,0 +1,119 @@
+"""PDF export of the reports, as background jobs.
+
+``start`` queues the export of a period and returns at once; the dashboard
+polls ``status`` until the PDF is ready. The report's HTML comes from the
+report cache and the PDF is laid out by WeasyPrint in a small pool of
+worker processes. Each worker sets up fonts and styles once and reuses them
+for every PDF. The PDF is saved next to the cached HTML, so it is cached
+for the same period and data version, and exporting it again is instant.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import streamlit as st
+
+import telemetry
+
+PDF_WORKERS = int(st.secrets.get("pdf_workers", 1))  # Processes laying out PDFs
+PDF_STYLESHEET = "@page { size: A4; margin: 1.5cm }"  # Added to the report's own styles
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_lock = threading.Lock()
+_jobs = None  # Threads preparing the HTML and waiting for the PDF
+_pool = None  # Processes running WeasyPrint
+_status = {}  # job id -> {'state', 'path', 'error'}
+
+_render_context = None  # (FontConfiguration, stylesheets) of a worker process
+
+
+def _init_worker():
+    global _render_context
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+
+    font_config = FontConfiguration()
+    _render_context = (font_config, [CSS(string=PDF_STYLESHEET, font_config=font_config)])
+
+
+def render_pdf(html_path, pdf_path):
+    """Lay out the report at ``html_path`` as a PDF. Runs in a worker process."""
+    from weasyprint import HTML
+
+    font_config, stylesheets = _render_context
+    HTML(filename=html_path).write_pdf(pdf_path + ".tmp", stylesheets=stylesheets, font_config=font_config)
+    os.replace(pdf_path + ".tmp", pdf_path)
+    return pdf_path
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, initializer=_init_worker)
+        return _pool
+
+
+def _render(html_path, pdf_path):
+    """Lay out the PDF in the pool, starting a new pool if a worker died or failed to start."""
+    global _pool
+    pool = _get_pool()
+    try:
+        return pool.submit(render_pdf, html_path, pdf_path).result()
+    except BrokenProcessPool:
+        with _lock:
+            if _pool is pool:
+                _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+def _export(job_id, year, month):
+    from reports import get_statistics
+
+    _status[job_id]['state'] = RUNNING
+    try:
+        html_path, message = get_statistics(year=year, month=month)
+        if html_path is None:
+            raise RuntimeError(message)
+        pdf_path = os.path.splitext(html_path)[0] + ".pdf"
+        if not os.path.exists(pdf_path):
+            with telemetry.span("reports.pdf"):
+                _render(html_path, pdf_path)
+        _status[job_id].update(state=DONE, path=pdf_path)
+    except Exception as e:
+        print(f"Failed to export the report of {month}/{year} as PDF: {str(e)}")
+        _status[job_id].update(state=FAILED, error=str(e))
+
+
+def start(year=None, month=None):
+    """Queue the PDF export of the report of ``year`` and ``month`` and return its job id.
+
+    Asking again for a period whose export is queued, running or done
+    returns the same job, as long as the data didn't change.
+    """
+    import report_cache
+    from storage import get_store
+
+    global _jobs
+    job_id = report_cache.report_key(f"{year or 'all'}_{month or 'all'}", get_store().data_version())
+    with _lock:
+        current = _status.get(job_id)
+        if current and (current['state'] in (QUEUED, RUNNING) or
+                        current['state'] == DONE and os.path.exists(current['path'])):
+            return job_id
+        if _jobs is None:
+            _jobs = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf-export")
+        _status[job_id] = {'state': QUEUED, 'path': None, 'error': None}
+        _jobs.submit(_export, job_id, year, month)
+    return job_id
+
+
+def status(job_id):
+    """Return the ``state`` of an export, with the PDF's ``path`` once it is done or the ``error`` if it failed."""
+    return dict(_status.get(job_id, {'state': FAILED, 'path': None, 'error': "Unknown export"}))
@@ -0,0 +1,73 @@
+"""Cache of the generated reports.
+
+Every report is written to its own directory under ``reports/``, named
+after the period and the version of the data it was built from. Asking
+again for the same period before the data changes returns the existing
+report. Only the ``REPORT_CACHE_SIZE`` most recently used reports are kept;
+anything older in ``reports/``, including reports generated before there
+was a cache, is deleted.
+"""
+import glob
+import hashlib
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import streamlit as st
+
+import disk_cache
+
+REPORT_DIR = os.path.join(os.getcwd(), 'reports')
+REPORT_CACHE_SIZE = int(st.secrets.get("report_cache_size", 24))  # Reports kept on disk
+TEMPLATE_PATH = 'report_template.html'
+REPORT_FORMAT = 2  # Bumped when reports are built differently, so older cached ones aren't served
+
+_lock = threading.Lock()
+
+
+def report_key(period, version):
+    """Return the name of the directory of the report of ``period``, or a new one if ``version`` is None."""
+    if version is None:
+        return "uncached_" + datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    with open(TEMPLATE_PATH, 'rb') as f:
+        template = hashlib.sha256(f.read()).hexdigest()
+    digest = hashlib.sha256(f"{REPORT_FORMAT}\0{version}\0{template}".encode()).hexdigest()[:16]
+    return f"{period}_{digest}"
+
+
+def _find(directory):
+    reports = glob.glob(os.path.join(directory, 'report_*.html'))
+    return reports[0] if reports else None
+
+
+def cached_report(period, version):
+    """Return the path of the cached report of ``period``, or None."""
+    if version is None:
+        return None
+    return _find(os.path.join(REPORT_DIR, report_key(period, version)))
+
+
+def get_report(period, version, build):
+    """Return the path of the report of ``period`` (a name for it), building it if it isn't cached.
+
+    ``build(report_dir)`` writes the report to ``report_dir`` and returns its path.
+    """
+    directory = os.path.join(REPORT_DIR, report_key(period, version))
+    with _lock:
+        path = _find(directory)
+        if path is None:
+            os.makedirs(directory, exist_ok=True)
+            try:
+                path = build(directory)
+            except Exception:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise
+        disk_cache.touch(directory)
+        evict()
+    return path
+
+
+def evict(size=None):
+    """Delete everything in ``reports/`` but the ``size`` most recently used reports."""
+    disk_cache.evict([entry.path for entry in os.scandir(REPORT_DIR)], REPORT_CACHE_SIZE if size is None else size)
@@ -1,83 +1,52 @@
-import json
+"""Monthly and yearly reports of the requests.
+
+markdown is imported by the function that uses it, and charts load
+matplotlib in their worker processes, so the dashboard only pays for them
+when a report is actually generated. Reports are single HTML files with
+their charts embedded.
+"""
+import os
+from datetime import datetime
 
-import markdown
-import streamlit as st
-from github import Github
 import pandas as pd
-from matplotlib import pyplot as plt
-from weasyprint import HTML
 
-REPO_URL = "https://raw.githubusercontent.com/karendcl/fbio-web-requests/main/"
-GITHUB_TOKEN = st.secrets["github_token"]  # Use Streamlit secrets in production
-REPO_NAME = "karendcl/fbio-web-requests"  # Your repo
-FILE_PATH = "data.json"  # Path to your JSON file
-BRANCH = "main"  # Branch to update
+import charts
+import report_cache
+import states
+import telemetry
+from storage import get_store
 
 
 def get_json():
-    """Get the JSON file from GitHub."""
-    g = Github(GITHUB_TOKEN)
-    repo = g.get_repo(REPO_NAME)
-
-    try:
-        # Get current JSON file
-        file = repo.get_contents(FILE_PATH, ref=BRANCH)
-        sha = file.sha
-        current_data = json.loads(file.decoded_content.decode())
-    except:
-        # File doesn't exist yet
-        sha = None
-        current_data = []
-
-    return current_data
+    """Get every request from the configured storage backend."""
+    return get_store().list_requests()
 
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import os
-from datetime import datetime
+def chart_inputs(dept_stats):
+    """Return the pie and bar charts of ``dept_stats`` as ``(function, args)`` for ``charts.render``."""
+    departments = tuple(dept_stats['Departamento'])
+    return [
+        (charts.pie_chart, (departments, tuple(int(n) for n in dept_stats['Total de Solicitudes']))),
+        (charts.bar_chart, (departments, tuple(int(n) for n in dept_stats['Pendiente']),
+                            tuple(int(n) for n in dept_stats['Publicada']))),
+    ]
 
 
-def generate_graphs(dept_stats, timestamp, report_dir):
+def generate_graphs(dept_stats):
+    """Return the data URIs of the pie and bar charts of ``dept_stats``."""
     # validate that there is at least one post
     if dept_stats.empty:
         return '', ''
+    return charts.render(chart_inputs(dept_stats))
 
-    # Generate charts
-    plt.figure(figsize=(10, 6))
-    dept_stats['Total de Solicitudes'].plot.pie(
-        labels=dept_stats['Departamento'],  # Use department names as labels
-        autopct='%1.1f%%',
-        startangle=90
-    )
-    plt.axis('equal')
-    plt.title('Total de Solicitudes por Departamento')
-    pie_chart_name = f'total_requests_pie_{timestamp}.png'
-    pie_chart_path = os.path.join(report_dir, pie_chart_name)
-    plt.savefig(pie_chart_path)
-    plt.close()
-
-    plt.figure(figsize=(12, 6))
-    ax = dept_stats[['Pendiente', 'Publicada']].plot(kind='bar')
-    plt.title('Estado de Solicitudes por Departamento')
-    plt.xlabel('Departamento')
-    plt.ylabel('Cantidad de Solicitudes')
-    # Set department names as x-axis labels
-    ax.set_xticklabels(dept_stats['Departamento'], rotation=45)
-    plt.legend(title='Estado de Solicitud', labels=['Pendiente', 'Publicada'])
-    plt.tight_layout()
-
-    bar_chart_name = f'requests_status_bar_{timestamp}.png'
-    bar_chart_path = os.path.join(report_dir, bar_chart_name)
-    plt.savefig(bar_chart_path)
-    plt.close()
-
-    return pie_chart_path, bar_chart_path
-
-def generate_report_html(month, year, total_requests, total_pending, total_approved, dept_stats, pie_chart_path, bar_chart_path,
+
+def generate_report_html(month, year, total_requests, total_pending, total_approved, dept_stats, pie_chart, bar_chart,
                          report_dir, timestamp, user_stats, total_approved_perc, total_historical_approved_perc,
-                         total_historical_requests, total_historical_pending, total_historical_approved, post_stats):
-    heading = f"Reporte {'mensual' if month else 'anual'} {'- ' + str(month) if month else ''} {year if year else ''}"
+                         total_historical_requests, total_historical_pending, total_historical_approved, post_stats,
+                         heading=None):
+    import markdown
+
+    heading = heading or f"Reporte {'mensual' if month else 'anual'} {'- ' + str(month) if month else ''} {year if year else ''}"
     date = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
 
     # Generate report by taking the report_template in html and replacing the variables
@@ -100,152 +69,130 @@ def generate_report_html(month, year, total_requests, total_pending, total_appro
     report_template = report_template.replace("DEPARTMENT_TABLES", dept_stats.to_html())
     report_template = report_template.replace("USER_TABLES", user_stats.to_html())
     report_template = report_template.replace("POST_TABLES", post_stats.to_html())
-    report_template = report_template.replace("IMAGE_TOTAL_DEPARTMENTS", pie_chart_path)
-    report_template = report_template.replace("IMAGE_STATE_DEPARTMENTS", bar_chart_path)
-    # Save report
+    # Save report; the charts go in after markdown, which would otherwise scan their whole data URIs
     report = markdown.markdown(report_template)
+    report = report.replace("IMAGE_TOTAL_DEPARTMENTS", pie_chart)
+    report = report.replace("IMAGE_STATE_DEPARTMENTS", bar_chart)
     report_path = os.path.join(report_dir, f'report_{timestamp}.html')
     with open(report_path, 'w', encoding='utf-8') as f:
         f.write(report)
 
     return report_path
 
-def get_statistics(year=None, month=None):
-    try:
-        # Load and prepare data
-        df = pd.DataFrame(get_json())
-        df['timestamp'] = pd.to_datetime(df['timestamp'], format="%Y%m%d_%H%M%S")
-
-        total_historical_requests = len(df)
-        total_historical_pending = len(df[df['state'] == 'pending'])
-        total_historical_approved = len(df[df['state'] == 'posted'])
-        total_historical_approved_perc = round(((total_historical_approved / total_historical_requests) * 100), 2) if total_historical_requests > 0 else 0
-
-        # Filter data
-        if year:
-            df = df[df['timestamp'].dt.year == year]
-        if month:
-            df = df[df['timestamp'].dt.month == month]
-
-        # Calculate statistics
-        total_requests = len(df)
-        total_pending = len(df[df['state'] == 'pending'])
-        total_approved = len(df[df['state'] == 'posted'])
-        total_approved_perc = round(((total_approved / total_requests) * 100), 2) if total_requests > 0 else 0
-
-        # Department-wise statistics
-        # Department statistics - FIXED THE COLUMN MISMATCH HERE
-        dept_counts = df['department'].value_counts().reset_index()
-        dept_counts.columns = ['Departamento', 'Total de Solicitudes']  # Only 2 columns here
-
-        # Calculate pending and approved separately
-        pending = df[df['state'] == 'pending']['department'].value_counts()
-        approved = df[df['state'] == 'posted']['department'].value_counts()
-
-        # Merge all statistics
-        dept_stats = dept_counts.merge(
-            pending.rename('Pendiente'),
-            left_on='Departamento',
-            right_index=True,
-            how='left'
-        ).merge(
-            approved.rename('Publicada'),
-            left_on='Departamento',
-            right_index=True,
-            how='left'
-        ).fillna(0)
-
-        # Convert counts to integers
-        dept_stats['Pendiente'] = dept_stats['Pendiente'].astype(int)
-        dept_stats['Publicada'] = dept_stats['Publicada'].astype(int)
-
-        # Final formatting
-        dept_stats['Departamento'] = dept_stats['Departamento'].str.capitalize()
-        dept_stats = dept_stats.sort_values('Total de Solicitudes', ascending=False)
-
-
-        # Add a column for the percentage of posted requests per department
-        dept_stats['% Publicada'] = (dept_stats['Publicada'] / dept_stats['Total de Solicitudes']) * 100
-        dept_stats['% Publicada'] = dept_stats['% Publicada'].fillna(0).round(2)
-        dept_stats['% Publicada'] = dept_stats['% Publicada'].astype(str) + '%'
-
-
-        # Add a column for the percentage of posted requests per department
-        dept_stats['% Publicada del total'] = (dept_stats['Publicada'] / total_approved) * 100
-        dept_stats['% Publicada del total'] = dept_stats['% Publicada del total'].fillna(0).round(2)
-        dept_stats['% Publicada del total'] = dept_stats['% Publicada del total'].astype(str) + '%'
-
-        all_posts = df[df['state'] == 'posted']
-        # Make a table with topic and message per posted post
-        all_posts = all_posts[['topic', 'message', 'department']]
-        all_posts = all_posts.rename(columns={
-            'topic': 'Tema',
-            'message': 'Mensaje',
-            'department': 'Departamento'
-        })
-        all_posts = all_posts.reset_index(drop=True)
-
-
-
-        user_stats = (
-            df.groupby('user_email')
-            .agg(
-                Total_Solicitudes=('user_email', 'count'),
-                Departamento=('department', lambda x: x.mode()[0] if len(x.mode()) > 0 else 'N/A')
-            )
-            .reset_index()
-            .rename(columns={
-                'user_email': 'Usuario',
-                'Total_Solicitudes': 'Total Solicitudes',
-                'Departamento': 'Departamento'
-            })
-        )
-
-        # Calculate percentage of total requests
-        user_stats['% del Total'] = (
-                (user_stats['Total Solicitudes'] / total_requests * 100)
-                .round(2)
-                .astype(str) + '%'
-        )
-
-        # Sort by most active users
-        user_stats = user_stats.sort_values('Total Solicitudes', ascending=False)
-
-        # Reset index for cleaner output
-        user_stats = user_stats.reset_index(drop=True)
-
-        # Create output directory if it doesn't exist
-        report_dir = os.path.join(os.getcwd(), 'reports')
-        os.makedirs(report_dir, exist_ok=True)
-
-        # Generate timestamp for filenames
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-        pie_chart_path, bar_chart_path = generate_graphs(dept_stats, timestamp, report_dir)
-
-        report_path = generate_report_html(month, year, total_requests, total_pending, total_approved,
-                                           dept_stats, pie_chart_path, bar_chart_path,
-                                           report_dir, timestamp, user_stats, total_approved_perc, total_historical_approved_perc,
-                                           total_historical_requests, total_historical_pending, total_historical_approved, all_posts)
-        return report_path, 'success'
-
-    except Exception as e:
-        return None, str(e)
-
-
-
-
-
-
-
-
 
+def _posted_requests(year=None, month=None):
+    """Return the posted requests submitted in ``year`` and ``month`` (either may be None)."""
+    if year:
+        start = f"{year:04d}{month:02d}" if month else f"{year:04d}"
+        end = (f"{year + month // 12:04d}{month % 12 + 1:02d}" if month else f"{year + 1:04d}")
+        return get_store().list_requests(state=states.POSTED, start=start, end=end)
+    requests = get_store().list_requests(state=states.POSTED)
+    if month:
+        requests = [request for request in requests if request['timestamp'][4:6] == f"{month:02d}"]
+    return requests
+
+
+def _most_common(departments):
+    """Return the department a user sent most requests from, the first alphabetically on a tie."""
+    departments = {department: count for department, count in departments.items() if department and count}
+    if not departments:
+        return 'N/A'
+    return min(departments, key=lambda department: (-departments[department], department))
+
+
+def compute_statistics(history, period, posted):
+    """Return the figures and tables of a report, as keyword arguments of ``generate_report_html``.
+
+    ``history`` and ``period`` are ``aggregates`` rollups of every request
+    and of the requests of the period, and ``posted`` lists the posted
+    requests of the period.
+    """
+    total_historical_requests = sum(history['states'].values())
+    total_historical_pending = history['states'].get(states.PENDING, 0)
+    total_historical_approved = history['states'].get(states.POSTED, 0)
+    total_historical_approved_perc = round(((total_historical_approved / total_historical_requests) * 100), 2) if total_historical_requests > 0 else 0
+
+    # Calculate statistics
+    total_requests = sum(period['states'].values())
+    total_pending = period['states'].get(states.PENDING, 0)
+    total_approved = period['states'].get(states.POSTED, 0)
+    total_approved_perc = round(((total_approved / total_requests) * 100), 2) if total_requests > 0 else 0
+
+    # Department-wise statistics
+    dept_stats = pd.DataFrame(
+        [(department, sum(counts.values()), counts.get(states.PENDING, 0), counts.get(states.POSTED, 0))
+         for department, counts in period['departments'].items() if department and sum(counts.values())],
+        columns=['Departamento', 'Total de Solicitudes', 'Pendiente', 'Publicada'])
+
+    # Final formatting
+    dept_stats['Departamento'] = dept_stats['Departamento'].str.capitalize()
+    dept_stats = dept_stats.sort_values('Total de Solicitudes', ascending=False)
+
+
+    # Add a column for the percentage of posted requests per department
+    dept_stats['% Publicada'] = (dept_stats['Publicada'] / dept_stats['Total de Solicitudes']) * 100
+    dept_stats['% Publicada'] = dept_stats['% Publicada'].fillna(0).round(2)
+    dept_stats['% Publicada'] = dept_stats['% Publicada'].astype(str) + '%'
+
+
+    # Add a column for the percentage of posted requests per department
+    dept_stats['% Publicada del total'] = (dept_stats['Publicada'] / total_approved) * 100
+    dept_stats['% Publicada del total'] = dept_stats['% Publicada del total'].fillna(0).round(2)
+    dept_stats['% Publicada del total'] = dept_stats['% Publicada del total'].astype(str) + '%'
+
+    # Make a table with topic and message per posted post
+    all_posts = pd.DataFrame(
+        [(request['topic'], request['message'], request['department'])
+         for request in posted],
+        columns=['Tema', 'Mensaje', 'Departamento'])
+
+    user_stats = pd.DataFrame(
+        [(user_email, sum(departments.values()), _most_common(departments))
+         for user_email, departments in period['users'].items() if user_email and sum(departments.values())],
+        columns=['Usuario', 'Total Solicitudes', 'Departamento'])
+
+    # Calculate percentage of total requests
+    user_stats['% del Total'] = (
+            (user_stats['Total Solicitudes'] / total_requests * 100)
+            .round(2)
+            .astype(str) + '%'
+    )
 
+    # Sort by most active users
+    user_stats = user_stats.sort_values('Total Solicitudes', ascending=False)
 
+    # Reset index for cleaner output
+    user_stats = user_stats.reset_index(drop=True)
 
+    return {
+        'total_requests': total_requests, 'total_pending': total_pending, 'total_approved': total_approved,
+        'total_approved_perc': total_approved_perc, 'dept_stats': dept_stats, 'user_stats': user_stats,
+        'post_stats': all_posts, 'total_historical_requests': total_historical_requests,
+        'total_historical_pending': total_historical_pending, 'total_historical_approved': total_historical_approved,
+        'total_historical_approved_perc': total_historical_approved_perc,
+    }
 
 
+def _build_report(store, year, month, report_dir):
+    """Write the report of the period to ``report_dir`` and return its path."""
+    # Totals come from the monthly counts kept by the store, not from the requests themselves
+    stats = compute_statistics(store.monthly_stats(), store.monthly_stats(year or None, month or None),
+                               _posted_requests(year, month))
+    pie_chart, bar_chart = generate_graphs(stats['dept_stats'])
 
+    # Generate timestamp for filenames
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return generate_report_html(month, year, pie_chart=pie_chart, bar_chart=bar_chart,
+                                report_dir=report_dir, timestamp=timestamp, **stats)
 
 
+def get_statistics(year=None, month=None):
+    try:
+        store = get_store()
+        with telemetry.span("reports.generate"):
+            report_path = report_cache.get_report(f"{year or 'all'}_{month or 'all'}", store.data_version(),
+                                                  lambda report_dir: _build_report(store, year, month, report_dir))
+        return report_path, 'success'
 
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,106 @@
+"""Stable request ids and the in-memory index the data layer keeps by id."""
+import hashlib
+
+from aggregates import MonthlyAggregates
+
+CODE_LENGTH = 20  # Hex digits of the sha256 digest kept as id
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"  # Format of the timestamps of the requests and of the events
+
+
+def request_code(request):
+    """Return the stable id of a request: a digest of its content and timestamp.
+
+    Unlike ``hash()``, which is salted per process, it is the same on every run.
+    """
+    content = "\0".join(str(request.get(key, '')) for key in
+                        ('user_name', 'user_email', 'topic', 'department', 'message', 'timestamp'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:CODE_LENGTH]
+
+
+def is_stable_code(code):
+    return isinstance(code, str) and len(code) == CODE_LENGTH and all(c in "0123456789abcdef" for c in code)
+
+
+def plain_code(code):
+    """Return ``code`` as a plain Python value; codes coming from a DataFrame row are numpy scalars."""
+    return code.item() if hasattr(code, "item") else code
+
+
+class RequestIndex:
+    """The requests in submission order plus a dict from id to request.
+
+    Requests saved before ids were stable carry a per-process ``hash()`` as
+    code; they get their stable id when added, and the old code keeps
+    working as an alias so events written back then still apply.
+    """
+
+    def __init__(self, requests=()):
+        self.requests = []
+        self.by_code = {}
+        self._aliases = {}
+        self.pending_cleanup = set()  # Codes of posted requests whose attachments are still stored, kept by replay()
+        self.references = {}  # Attachment path -> codes of the requests that list it
+        self.files = {}  # Path -> size of every file stored next to the requests, when the loader knows them
+        self.aggregates = MonthlyAggregates()  # Monthly counts for the reports
+        self.version = None  # Identifies the data the requests were loaded from, when the loader knows it
+        self.period = None  # (first, last) months whose requests were loaded, when the loader skipped the others
+        for request in requests:
+            self.add(request)
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def add(self, request):
+        """Add a request and return True, or return False if its id is already known."""
+        code = request.get('code')
+        if not is_stable_code(code):
+            legacy_code = code
+            code = request['code'] = request_code(request)
+            if legacy_code is not None:
+                self._aliases.setdefault(plain_code(legacy_code), code)
+        if code in self.by_code:
+            return False
+        self.by_code[code] = request
+        self.requests.append(request)
+        self._link(request)
+        self.aggregates.add(request)
+        return True
+
+    def set_state(self, request, state):
+        """Change the state of a request, keeping ``aggregates`` up to date."""
+        self.aggregates.change_state(request, state)
+        request['state'] = state
+
+    def set_attachments(self, request, images, files):
+        """Replace the attachments of a request, keeping ``references`` up to date."""
+        self._unlink(request)
+        request['images'] = images
+        request['file'] = files
+        self._link(request)
+
+    def unreferenced(self, paths, codes):
+        """Return the ``paths`` that no request outside ``codes`` lists."""
+        codes = set(codes)
+        return [path for path in dict.fromkeys(paths) if self.references.get(path, set()) <= codes]
+
+    def _link(self, request):
+        for path in request.get('images', []) + request.get('file', []):
+            self.references.setdefault(path, set()).add(request['code'])
+
+    def _unlink(self, request):
+        for path in request.get('images', []) + request.get('file', []):
+            codes = self.references.get(path)
+            if codes is not None:
+                codes.discard(request['code'])
+                if not codes:
+                    del self.references[path]
+
+    def get(self, code):
+        code = plain_code(code)
+        request = self.by_code.get(code)
+        if request is None and code in self._aliases:
+            request = self.by_code.get(self._aliases[code])
+        return request
@@ -0,0 +1,91 @@
+"""Inverted index for searching requests by text.
+
+Words are folded to lower case without accents ("Bioquímica" and
+"bioquimica" are the same word), and every word of a query matches the
+words starting with it. The index only grows: requests are added once, as
+they show up, and never need to be reindexed because the searched fields
+don't change after a request is created.
+"""
+import bisect
+import re
+import threading
+import unicodedata
+
+FIELDS = ('topic', 'message', 'user_name', 'user_email')  # Request keys that are searched
+
+
+def normalize(text):
+    """Fold ``text`` to lower case and strip its accents."""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return re.findall(r"\w+", normalize(text))
+
+
+class SearchIndex:
+    """Maps every word of the indexed requests to their codes."""
+
+    def __init__(self):
+        self._postings = {}  # word -> set of codes
+        self._words = []  # Every word, sorted before searching, to find those starting with a prefix
+        self._sorted = True
+        self._indexed = set()
+        self._version = None  # Version of the data at the last update()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._indexed)
+
+    def add(self, request):
+        """Index a request, unless it already is."""
+        code = request['code']
+        with self._lock:
+            if code in self._indexed:
+                return
+            self._indexed.add(code)
+            for word in set(tokenize(" ".join(str(request.get(field) or "") for field in FIELDS))):
+                codes = self._postings.get(word)
+                if codes is None:
+                    codes = self._postings[word] = set()
+                    self._words.append(word)
+                    self._sorted = False
+                codes.add(code)
+
+    def update(self, requests, version=None):
+        """Index the requests of ``requests`` that aren't yet, wherever they are in the list.
+
+        With the ``version`` of the data, requests already indexed at that
+        version aren't looked at again.
+        """
+        if version is not None and version == self._version:
+            return
+        for request in requests:
+            if request['code'] not in self._indexed:
+                self.add(request)
+        self._version = version
+
+    def search(self, query):
+        """Return the codes of the requests containing every word of ``query`` (as a prefix).
+
+        Returns None if the query has no words.
+        """
+        words = tokenize(query)
+        if not words:
+            return None
+        result = None
+        with self._lock:
+            if not self._sorted:
+                self._words.sort()
+                self._sorted = True
+            for prefix in words:
+                codes = set()
+                i = bisect.bisect_left(self._words, prefix)
+                while i < len(self._words) and self._words[i].startswith(prefix):
+                    codes |= self._postings[self._words[i]]
+                    i += 1
+                result = codes if result is None else result & codes
+                if not result:
+                    break
+        return result
@@ -0,0 +1,92 @@
+"""Columnar snapshot of every request, cached on disk per data version.
+
+The requests are written once per version of the data (see
+``RequestStore.data_version``) as an Arrow file under ``snapshots/``, with
+typed columns: ``state`` and ``department`` are categories, ``timestamp``
+and ``posted_timestamp`` datetimes. Every later load for the same version
+memory-maps the file instead of listing, converting and parsing the
+requests again. Only the ``SNAPSHOT_CACHE_SIZE`` most recently used
+snapshots are kept.
+"""
+import glob
+import hashlib
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+import disk_cache
+from request_index import TIMESTAMP_FORMAT
+
+SNAPSHOT_DIR = os.path.join(os.getcwd(), 'snapshots')
+SNAPSHOT_CACHE_SIZE = int(st.secrets.get("snapshot_cache_size", 2))  # Snapshots kept on disk
+SNAPSHOT_FORMAT = 1  # Bumped when the columns change, so older snapshots aren't read
+
+TEXT_COLUMNS = ['code', 'user_name', 'user_email', 'topic', 'message']
+CATEGORY_COLUMNS = ['state', 'department']
+TIMESTAMP_COLUMNS = ['timestamp', 'posted_timestamp']
+COLUMNS = TEXT_COLUMNS + CATEGORY_COLUMNS + TIMESTAMP_COLUMNS
+
+_lock = threading.Lock()
+
+
+def to_frame(requests):
+    """Return ``requests`` as a typed DataFrame, oldest first; missing texts are empty."""
+    df = pd.DataFrame(requests, columns=COLUMNS)
+    for column in TEXT_COLUMNS:
+        df[column] = df[column].fillna('').astype(str)
+    for column in CATEGORY_COLUMNS:
+        df[column] = df[column].fillna('').astype('category')
+    for column in TIMESTAMP_COLUMNS:
+        df[column] = pd.to_datetime(df[column], format=TIMESTAMP_FORMAT)
+    return df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def snapshot_path(version):
+    digest = hashlib.sha256(f"{SNAPSHOT_FORMAT}\0{version}".encode()).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, f"requests_{digest}.arrow")
+
+
+def write(df, path):
+    """Write ``df`` to ``path`` as an uncompressed Arrow file, so it can be memory-mapped."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path + ".tmp", 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+
+def read(path):
+    """Memory-map the snapshot at ``path`` as a DataFrame."""
+    return pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas()
+
+
+def load(store):
+    """Return every request of ``store`` as a typed DataFrame (see ``to_frame``).
+
+    The snapshot of the store's current data version is built the first
+    time and memory-mapped afterwards. Stores that can't tell their version
+    get a fresh DataFrame every time.
+    """
+    version = store.data_version()
+    if version is None:
+        return to_frame(store.list_requests())
+    path = snapshot_path(version)
+    with _lock:
+        if not os.path.exists(path):
+            requests = store.list_requests()
+            if store.data_version() != version:
+                # Changed while listing, these requests belong to no known version
+                return to_frame(requests)
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            write(to_frame(requests), path)
+        disk_cache.touch(path)
+        evict()
+    return read(path)
+
+
+def evict(size=None):
+    """Delete every snapshot but the ``size`` most recently used ones."""
+    disk_cache.evict(glob.glob(os.path.join(SNAPSHOT_DIR, 'requests_*.arrow')),
+                     SNAPSHOT_CACHE_SIZE if size is None else size)
@@ -0,0 +1,650 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+
+import streamlit as st
+
+import attachment_store
+import states
+from aggregates import add_count, empty_rollup
+from attachment_store import UploadError
+from request_index import CODE_LENGTH, TIMESTAMP_FORMAT, is_stable_code, request_code
+from search_index import SearchIndex, tokenize
+
+# "github" keeps the requests in monthly partitions on the repo (the production setup),
+# "sqlite" keeps them in an indexed local database and is the default whenever
+# no GitHub token is configured.
+STORAGE_BACKEND = st.secrets.get("storage_backend", "github" if "github_token" in st.secrets else "sqlite")
+SQLITE_PATH = st.secrets.get("sqlite_path", "data/requests.db")
+REPO_URL = "https://raw.githubusercontent.com/karendcl/fbio-web-requests/main/"
+
+SORT_KEYS = ('timestamp', 'user_name', 'state', 'department', 'topic')  # What list_requests can order by
+
+
+def _as_timestamp(value):
+    """Return ``value`` in the ``%Y%m%d_%H%M%S`` format used by the requests."""
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+class RequestStore:
+    """Interface implemented by every storage backend.
+
+    Requests are plain dicts with the same keys as the entries of the partitions.
+    """
+
+    def create_request(self, request):
+        """Persist a new request, uploading the local attachments it lists."""
+        raise NotImplementedError
+
+    def create_requests(self, requests, progress=None, digests=None):
+        """Persist several new requests at once.
+
+        ``progress(local_path, error)`` is called as every attachment is
+        stored, with ``error`` None if it was. ``digests`` gives the
+        ``(sha256, git blob sha)`` of local attachments that were hashed
+        already, so they aren't read again. If any attachment can't be
+        stored, :class:`UploadError` is raised and no request is saved.
+        """
+        for request in requests:
+            self.create_request(request)
+            if progress:
+                for path in request['images'] + request['file']:
+                    progress(path, None)
+
+    def get_request(self, code):
+        """Return the request identified by ``code``, or None."""
+        raise NotImplementedError
+
+    def update_state(self, code, state):
+        """Change the state of the request identified by ``code``."""
+        raise NotImplementedError
+
+    def update_states(self, codes, state):
+        """Change the state of several requests at once.
+
+        Returns ``{code: error}``, where ``error`` is None for the requests that were updated.
+        """
+        results = {}
+        for code in codes:
+            try:
+                self.update_state(code, state)
+                results[code] = None
+            except Exception as e:
+                results[code] = str(e)
+        return results
+
+    def list_requests(self, state=None, department=None, start=None, end=None,
+                      order_by=None, descending=False, limit=None, offset=0, query=None):
+        """Return the requests matching every given filter.
+
+        ``start`` is inclusive and ``end`` exclusive; both may be datetimes or
+        timestamps in the requests' own format. ``query`` keeps the requests
+        containing every one of its words, ignoring case and accents, as
+        prefixes of the words of their topic, message, name or email.
+        ``order_by`` is one of ``SORT_KEYS`` (by default requests come in
+        submission order), and ``limit`` and ``offset`` select a page of the
+        results.
+        """
+        raise NotImplementedError
+
+    def count_requests(self, state=None, department=None, start=None, end=None, query=None):
+        """Return how many requests match every given filter."""
+        return len(self.list_requests(state, department, start, end, query=query))
+
+    def list_departments(self):
+        """Return the departments that have requests, sorted."""
+        raise NotImplementedError
+
+    def monthly_stats(self, year=None, month=None):
+        """Return the counts of the requests submitted in ``year`` and ``month``.
+
+        Either may be None to count every year or month. The result is an
+        ``aggregates`` rollup, added up from counts kept per month as requests
+        are created and change state.
+        """
+        raise NotImplementedError
+
+    def data_version(self):
+        """Return a string that changes whenever the requests change, or None if the backend can't tell."""
+        return None
+
+    def attach_files(self, code, images=(), files=()):
+        """Upload extra local attachments and add them to a request."""
+        raise NotImplementedError
+
+    def clean_attachments(self, codes=None, dry_run=False):
+        """Delete the attachments of every posted request, or only of those in ``codes``.
+
+        With ``dry_run`` nothing is deleted. Returns ``({code: error}, bytes
+        reclaimed)``, where ``error`` is None for the requests that were (or
+        would be) cleaned.
+        """
+        raise NotImplementedError
+
+    def attachment_url(self, path):
+        """Return a public URL for an attachment, or None if it is only local."""
+        return None
+
+    def thumbnail(self, path):
+        """Return the URL or local path of an image's thumbnail, or None if it has none."""
+        return None
+
+    def cache_stats(self):
+        """Return the hit/miss counters of the backend's read cache, if it has one."""
+        return {}
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Another file system, or one without hard links
+        shutil.copyfile(source, destination + ".tmp")
+        os.replace(destination + ".tmp", destination)
+
+
+def _check_sort_key(order_by):
+    if order_by is not None and order_by not in SORT_KEYS:
+        raise ValueError(f"Can't sort requests by {order_by}")
+
+
+def _matches(request, state=None, department=None, start=None, end=None):
+    if state is not None and request['state'] != state:
+        return False
+    if department is not None and request['department'] != department:
+        return False
+    if start is not None and request['timestamp'] < start:
+        return False
+    if end is not None and request['timestamp'] >= end:
+        return False
+    return True
+
+
+class GithubStore(RequestStore):
+    """Keeps the requests in monthly partitions on the GitHub repo (see ``partitions``)."""
+
+    def __init__(self):
+        self._search = SearchIndex()
+
+    def _filtered(self, state, department, start, end, query):
+        import automation
+        start, end = _as_timestamp(start), _as_timestamp(end)
+        # The search index is kept over every request, so searches load them all
+        period = automation.EVERY_MONTH if query else (start[:6] if start else automation.EVERY_MONTH[0],
+                                                       end[:6] if end else automation.EVERY_MONTH[1])
+        index = automation.get_index(period)
+        requests = index.requests
+        codes = None
+        if query:
+            self._search.update(requests, index.version)
+            codes = self._search.search(query)
+        return [request for request in requests
+                if _matches(request, state, department, start, end) and (codes is None or request['code'] in codes)]
+
+    def create_request(self, request):
+        import automation
+        automation.update_json(new_data=request)
+
+    def create_requests(self, requests, progress=None, digests=None):
+        import automation
+        automation.append_requests(requests, progress, digests)
+
+    def get_request(self, code):
+        import automation
+        return automation.get_index().get(code)
+
+    def update_state(self, code, state):
+        import automation
+        automation.update_state(code, state)
+
+    def update_states(self, codes, state):
+        import automation
+        return automation.update_states(codes, state)
+
+    def list_requests(self, state=None, department=None, start=None, end=None,
+                      order_by=None, descending=False, limit=None, offset=0, query=None):
+        _check_sort_key(order_by)
+        requests = self._filtered(state, department, start, end, query)
+        if order_by is not None:
+            requests.sort(key=lambda request: request.get(order_by) or "", reverse=descending)
+        return requests[offset:None if limit is None else offset + limit]
+
+    def count_requests(self, state=None, department=None, start=None, end=None, query=None):
+        return len(self._filtered(state, department, start, end, query))
+
+    def list_departments(self):
+        import automation
+        return sorted({request['department'] for request in automation.get_json() if request.get('department')})
+
+    def monthly_stats(self, year=None, month=None):
+        import automation
+        return automation.get_index(automation.NO_MONTH).aggregates.rollup(year, month)
+
+    def data_version(self):
+        import automation
+        return automation.get_index(automation.NO_MONTH).version
+
+    def attach_files(self, code, images=(), files=()):
+        import automation
+        automation.attach_files(code, list(images), list(files))
+
+    def clean_attachments(self, codes=None, dry_run=False):
+        import automation
+        return automation.clean_images_and_files(codes, dry_run)
+
+    def attachment_url(self, path):
+        return (REPO_URL + path).replace(' ', '%20')
+
+    def thumbnail(self, path):
+        import automation
+        thumbnail = attachment_store.thumbnail_path(path)
+        return self.attachment_url(thumbnail) if thumbnail in automation.get_index().files else None
+
+    def cache_stats(self):
+        import automation
+        return automation.cache.stats()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    code TEXT NOT NULL,
+    user_name TEXT,
+    user_email TEXT,
+    topic TEXT,
+    message TEXT,
+    images TEXT NOT NULL DEFAULT '[]',
+    file TEXT NOT NULL DEFAULT '[]',
+    state TEXT NOT NULL,
+    department TEXT,
+    timestamp TEXT NOT NULL,
+    posted_timestamp TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_requests_code_unique ON requests (code);
+CREATE INDEX IF NOT EXISTS idx_requests_state ON requests (state);
+CREATE INDEX IF NOT EXISTS idx_requests_department ON requests (department);
+CREATE INDEX IF NOT EXISTS idx_requests_timestamp ON requests (timestamp);
+CREATE TABLE IF NOT EXISTS attachment_refs (
+    path TEXT NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (path, code)
+);
+CREATE INDEX IF NOT EXISTS idx_attachment_refs_code ON attachment_refs (code);
+CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+    topic, message, user_name, user_email,
+    content='requests', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS requests_fts_insert AFTER INSERT ON requests BEGIN
+    INSERT INTO requests_fts (rowid, topic, message, user_name, user_email)
+    VALUES (new.id, new.topic, new.message, new.user_name, new.user_email);
+END;
+CREATE TRIGGER IF NOT EXISTS requests_fts_delete AFTER DELETE ON requests BEGIN
+    INSERT INTO requests_fts (requests_fts, rowid, topic, message, user_name, user_email)
+    VALUES ('delete', old.id, old.topic, old.message, old.user_name, old.user_email);
+END;
+CREATE TABLE IF NOT EXISTS monthly_stats (
+    month TEXT NOT NULL,
+    department TEXT NOT NULL,
+    user_email TEXT NOT NULL,
+    state TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (month, department, user_email, state)
+);
+CREATE TRIGGER IF NOT EXISTS monthly_stats_insert AFTER INSERT ON requests BEGIN
+    INSERT INTO monthly_stats (month, department, user_email, state, count)
+    VALUES (substr(new.timestamp, 1, 6), COALESCE(new.department, ''), COALESCE(new.user_email, ''), new.state, 1)
+    ON CONFLICT (month, department, user_email, state) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS monthly_stats_update AFTER UPDATE OF state ON requests
+WHEN old.state != new.state BEGIN
+    UPDATE monthly_stats SET count = count - 1
+    WHERE month = substr(old.timestamp, 1, 6) AND department = COALESCE(old.department, '')
+      AND user_email = COALESCE(old.user_email, '') AND state = old.state;
+    INSERT INTO monthly_stats (month, department, user_email, state, count)
+    VALUES (substr(new.timestamp, 1, 6), COALESCE(new.department, ''), COALESCE(new.user_email, ''), new.state, 1)
+    ON CONFLICT (month, department, user_email, state) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS monthly_stats_delete AFTER DELETE ON requests BEGIN
+    UPDATE monthly_stats SET count = count - 1
+    WHERE month = substr(old.timestamp, 1, 6) AND department = COALESCE(old.department, '')
+      AND user_email = COALESCE(old.user_email, '') AND state = old.state;
+END;
+CREATE TABLE IF NOT EXISTS data_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO data_version (id, version) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS data_version_insert AFTER INSERT ON requests BEGIN
+    UPDATE data_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS data_version_update AFTER UPDATE ON requests BEGIN
+    UPDATE data_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS data_version_delete AFTER DELETE ON requests BEGIN
+    UPDATE data_version SET version = version + 1;
+END;
+"""
+
+COLUMNS = ['code', 'user_name', 'user_email', 'topic', 'message', 'images', 'file',
+           'state', 'department', 'timestamp', 'posted_timestamp']
+
+
+class SQLiteStore(RequestStore):
+    """Keeps every request as a row of an indexed SQLite database.
+
+    Attachments stay on the local disk next to the database, stored once per
+    content like in the GitHub repo; ``attachment_refs`` links every request
+    to the attachments it lists.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate_codes()
+        has_refs = self._conn.execute("SELECT name FROM sqlite_master WHERE name = 'attachment_refs'").fetchone()
+        has_fts = self._conn.execute("SELECT name FROM sqlite_master WHERE name = 'requests_fts'").fetchone()
+        has_stats = self._conn.execute("SELECT name FROM sqlite_master WHERE name = 'monthly_stats'").fetchone()
+        self._conn.executescript(SCHEMA)
+        if not has_stats:
+            with self._conn:
+                self._conn.execute("INSERT INTO monthly_stats (month, department, user_email, state, count) "
+                                   "SELECT substr(timestamp, 1, 6), COALESCE(department, ''), "
+                                   "COALESCE(user_email, ''), state, COUNT(*) FROM requests GROUP BY 1, 2, 3, 4")
+        if not has_fts:
+            with self._conn:
+                self._conn.execute("INSERT INTO requests_fts (requests_fts) VALUES ('rebuild')")
+        if not has_refs:
+            with self._conn:
+                for column in ('images', 'file'):
+                    self._conn.execute(f"INSERT OR IGNORE INTO attachment_refs (path, code) "
+                                       f"SELECT value, code FROM requests, json_each(requests.{column})")
+
+    def _migrate_codes(self):
+        """Give rows saved with per-process ``hash()`` codes their stable id."""
+        if not self._conn.execute("SELECT name FROM sqlite_master WHERE name = 'requests'").fetchone():
+            return
+        with self._conn:
+            self._conn.execute("DROP INDEX IF EXISTS idx_requests_code")
+            rows = self._conn.execute(f"SELECT id, {', '.join(COLUMNS)} FROM requests "
+                                      f"WHERE length(code) != {CODE_LENGTH} OR code GLOB '*[^0-9a-f]*'").fetchall()
+            seen = {code for code, in self._conn.execute("SELECT code FROM requests")}
+            for row in rows:
+                code = request_code(dict(row))
+                if code in seen:
+                    # Same content and timestamp: a duplicate of a row we already kept
+                    self._conn.execute("DELETE FROM requests WHERE id = ?", (row['id'],))
+                else:
+                    seen.add(code)
+                    self._conn.execute("UPDATE requests SET code = ? WHERE id = ?", (code, row['id']))
+
+    @staticmethod
+    def _to_row(request):
+        row = dict(request)
+        if not is_stable_code(row.get('code')):
+            row['code'] = request_code(row)
+        row['images'] = json.dumps(row.get('images', []))
+        row['file'] = json.dumps(row.get('file', []))
+        return tuple(row.get(column) for column in COLUMNS)
+
+    @staticmethod
+    def _from_row(row):
+        request = {column: row[column] for column in COLUMNS}
+        request['images'] = json.loads(request['images'])
+        request['file'] = json.loads(request['file'])
+        if request['posted_timestamp'] is None:
+            del request['posted_timestamp']
+        return request
+
+    def _store_attachments(self, paths, kind, progress=None, digests=None):
+        """Store uploaded files at their content-addressed local path and return those paths.
+
+        The uploads are linked (or copied) rather than moved, so a batch
+        that fails can be stored again; the spool deletes them once saved.
+        Raises :class:`UploadError` if any of them couldn't be stored.
+        """
+        directory = os.path.join(os.path.dirname(self.path) or ".", "attachments")
+        os.makedirs(directory, exist_ok=True)
+        stored_paths = []
+        failures = {}
+        for local_path in paths:
+            try:
+                digest, _ = (digests or {}).get(local_path) or attachment_store.hash_file(local_path)
+                stored_path = os.path.join(directory, attachment_store.content_name(digest, local_path))
+                if not os.path.isfile(local_path):
+                    # Hashed while spooling, so nothing else noticed it is gone
+                    raise FileNotFoundError(f"No such file: {local_path}")
+                for source, destination in zip([local_path] + attachment_store.derived_paths(local_path),
+                                               [stored_path] + attachment_store.derived_paths(stored_path)):
+                    # Thumbnails and originals are optional
+                    if not os.path.isfile(source):
+                        continue
+                    if not os.path.exists(destination):
+                        _link_or_copy(source, destination)
+                stored_paths.append(stored_path)
+                error = None
+            except Exception as e:
+                print(f"Failed to store {kind} {local_path}: {str(e)}")
+                error = failures[local_path] = str(e)
+            if progress:
+                progress(local_path, error)
+        if failures:
+            raise UploadError(failures)
+        return stored_paths
+
+    def _add_refs(self, code, paths):
+        self._conn.executemany("INSERT OR IGNORE INTO attachment_refs (path, code) VALUES (?, ?)",
+                               [(path, code) for path in paths])
+
+    def import_records(self, requests):
+        """Bulk load existing requests, e.g. a downloaded data.json.
+
+        Requests whose id is already stored are skipped.
+        """
+        rows = [self._to_row(request) for request in requests]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO requests ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows)
+            for row in rows:
+                request = dict(zip(COLUMNS, row))
+                self._add_refs(request['code'], json.loads(request['images']) + json.loads(request['file']))
+
+    def create_request(self, request):
+        self.create_requests([request])
+
+    def create_requests(self, requests, progress=None, digests=None):
+        stored = []
+        failures = {}
+        for request in requests:
+            request = dict(request)
+            for key, kind in (('images', "image"), ('file', "file")):
+                try:
+                    request[key] = self._store_attachments(request[key], kind, progress, digests)
+                except UploadError as e:
+                    failures.update(e.failures)
+            stored.append(request)
+        # None of the requests is saved without its attachments
+        if failures:
+            raise UploadError(failures)
+        self.import_records(stored)
+
+    def get_request(self, code):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM requests WHERE code = ?", (str(code),)).fetchone()
+        return None if row is None else self._from_row(row)
+
+    def thumbnail(self, path):
+        thumbnail = attachment_store.thumbnail_path(path)
+        return thumbnail if os.path.exists(thumbnail) else None
+
+    def update_state(self, code, state):
+        posted_timestamp = datetime.now().strftime(TIMESTAMP_FORMAT) if state == states.POSTED else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE requests SET state = ?, posted_timestamp = COALESCE(?, posted_timestamp) WHERE code = ?",
+                (state, posted_timestamp, str(code)))
+
+    def update_states(self, codes, state):
+        posted_timestamp = datetime.now().strftime(TIMESTAMP_FORMAT) if state == states.POSTED else None
+        with self._lock, self._conn:
+            results = {}
+            for code in codes:
+                cursor = self._conn.execute(
+                    "UPDATE requests SET state = ?, posted_timestamp = COALESCE(?, posted_timestamp) WHERE code = ?",
+                    (state, posted_timestamp, str(code)))
+                results[code] = None if cursor.rowcount else "Request not found"
+        return results
+
+    @staticmethod
+    def _where(state=None, department=None, start=None, end=None, query=None):
+        clauses, params = [], []
+        words = tokenize(query) if query else []
+        for clause, value in (("state = ?", state),
+                              ("department = ?", department),
+                              ("timestamp >= ?", _as_timestamp(start)),
+                              ("timestamp < ?", _as_timestamp(end)),
+                              ("id IN (SELECT rowid FROM requests_fts WHERE requests_fts MATCH ?)",
+                               " ".join(f'"{word}"*' for word in words) or None)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def list_requests(self, state=None, department=None, start=None, end=None,
+                      order_by=None, descending=False, limit=None, offset=0, query=None):
+        _check_sort_key(order_by)
+        where, params = self._where(state, department, start, end, query)
+        query = f"SELECT * FROM requests{where} ORDER BY {order_by or 'timestamp'}{' DESC' if descending else ''}, id"
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        elif offset:
+            query += " LIMIT -1 OFFSET ?"
+            params.append(offset)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def count_requests(self, state=None, department=None, start=None, end=None, query=None):
+        where, params = self._where(state, department, start, end, query)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM requests{where}", params).fetchone()[0]
+
+    def list_departments(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT department FROM requests "
+                                      "WHERE department IS NOT NULL ORDER BY department").fetchall()
+        return [row[0] for row in rows]
+
+    def monthly_stats(self, year=None, month=None):
+        clauses, params = ["count > 0"], []
+        if year is not None:
+            clauses.append("substr(month, 1, 4) = ?")
+            params.append(f"{year:04d}")
+        if month is not None:
+            clauses.append("substr(month, 5, 2) = ?")
+            params.append(f"{month:02d}")
+        with self._lock:
+            rows = self._conn.execute(f"SELECT department, user_email, state, SUM(count) FROM monthly_stats "
+                                      f"WHERE {' AND '.join(clauses)} GROUP BY department, user_email, state",
+                                      params).fetchall()
+        rollup = empty_rollup()
+        for department, user_email, state, count in rows:
+            add_count(rollup, department, user_email, state, count)
+        return rollup
+
+    def data_version(self):
+        with self._lock:
+            version, = self._conn.execute("SELECT version FROM data_version").fetchone()
+            last_id, = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM requests").fetchone()
+        return f"{os.path.abspath(self.path)}:{last_id}:{version}"
+
+    def attach_files(self, code, images=(), files=()):
+        image_paths = self._store_attachments(images, "image")
+        file_paths = self._store_attachments(files, "file")
+        with self._lock, self._conn:
+            for row in self._conn.execute("SELECT id, images, file FROM requests WHERE code = ?",
+                                          (str(code),)).fetchall():
+                self._conn.execute(
+                    "UPDATE requests SET images = ?, file = ? WHERE id = ?",
+                    (json.dumps(json.loads(row['images']) + image_paths),
+                     json.dumps(json.loads(row['file']) + file_paths),
+                     row['id']))
+                self._add_refs(str(code), image_paths + file_paths)
+
+    def clean_attachments(self, codes=None, dry_run=False):
+        with self._lock, self._conn:
+            if codes is None:
+                rows = self._conn.execute(
+                    "SELECT id, code, state, images, file FROM requests "
+                    "WHERE state = ? AND (images != '[]' OR file != '[]')",
+                    (states.POSTED,)).fetchall()
+                codes = [row['code'] for row in rows]
+            else:
+                rows = self._conn.execute(
+                    f"SELECT id, code, state, images, file FROM requests WHERE code IN ({', '.join('?' * len(codes))})",
+                    [str(code) for code in codes]).fetchall()
+            rows = {row['code']: row for row in rows}
+
+            results = {}
+            cleaned = {}
+            for code in codes:
+                row = rows.get(str(code))
+                if row is None:
+                    results[code] = "Request not found"
+                elif row['state'] != states.POSTED:
+                    results[code] = "Request is not posted yet"
+                else:
+                    results[code] = None
+                    cleaned[row['code']] = row
+
+            # An attachment still listed by a request that is not being cleaned stays
+            paths = dict.fromkeys(path for row in cleaned.values()
+                                  for path in json.loads(row['images']) + json.loads(row['file']))
+            deletions = [path for path in paths
+                         if {code for code, in self._conn.execute("SELECT code FROM attachment_refs WHERE path = ?",
+                                                                  (path,))} <= cleaned.keys()]
+            deletions += [derived for path in deletions for derived in attachment_store.derived_paths(path)
+                          if os.path.exists(derived)]
+            reclaimed = 0
+            for path in deletions:
+                try:
+                    reclaimed += os.path.getsize(path)
+                    if not dry_run:
+                        os.remove(path)
+                except OSError as e:
+                    print(f"Failed to delete {path}: {str(e)}")
+            if not dry_run:
+                self._conn.executemany("UPDATE requests SET images = '[]', file = '[]' WHERE id = ?",
+                                       [(row['id'],) for row in cleaned.values()])
+                self._conn.executemany("DELETE FROM attachment_refs WHERE code = ?", [(code,) for code in cleaned])
+        return results, reclaimed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide store for the configured backend."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORAGE_BACKEND == "sqlite":
+                _store = SQLiteStore(SQLITE_PATH)
+            elif STORAGE_BACKEND == "github":
+                _store = GithubStore()
+            else:
+                raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+        return _store
@@ -0,0 +1,379 @@
+"""Durable local spool for form submissions.
+
+Submitting only moves the request and its attachments into ``SPOOL_DIR``;
+a background writer collects whatever is pending and saves it in batches,
+so several submissions share one read of the event log and one commit.
+A submission whose attachments can't be uploaded is retried on its own,
+backing off, and set aside in ``FAILED_DIR`` once it failed
+``MAX_ATTEMPTS`` times, or right away if it can't even be read. Run
+``python submission_queue.py`` to flush the spool by hand, with
+``--retry-failed`` to queue the set aside ones again.
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+if os.name == "posix":
+    import fcntl
+else:
+    import msvcrt
+
+import streamlit as st
+
+import attachment_store
+import telemetry
+from github_client import background
+from storage import get_store
+
+SPOOL_DIR = st.secrets.get("spool_dir", "data/spool")
+FLUSH_INTERVAL = float(st.secrets.get("flush_interval", 5))  # Seconds between flushes
+BATCH_SIZE = int(st.secrets.get("flush_batch_size", 20))  # Most submissions saved per flush
+MAX_ATTEMPTS = int(st.secrets.get("spool_max_attempts", 8))  # Failed saves before a submission is set aside
+FAILED_DIR = st.secrets.get("spool_failed_dir", "data/spool_failed")  # Where submissions that kept failing go
+
+REQUEST_FILE = "request.json"
+DIGESTS_FILE = "digests.json"  # sha256, git blob sha and size of every spooled attachment
+OPTIMIZED_FILE = "optimized"  # Marks a submission whose images were optimized, so retries don't do it again
+ATTEMPTS_FILE = "attempts.json"  # Failed saves of a submission, when to try again and the last errors
+LOCK_FILE = ".lock"  # Locked by the process flushing the spool
+CHUNK_SIZE = 1024 * 1024  # Bytes copied at a time when spooling an attachment
+STAGING_SUFFIX = ".tmp"
+DONE_SUFFIX = ".done"  # A saved submission is renamed to this before it is deleted
+
+_wake = threading.Event()
+_flush_lock = threading.Lock()
+_writer_lock = threading.Lock()
+_writer = None
+_status = {}  # ticket -> {'total', 'uploaded', 'failed'} while the writer is saving it
+
+
+def _fsync(path):
+    """Flush a file or directory to disk."""
+    if os.name != "posix" and os.path.isdir(path):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _spool_attachment(source, destination):
+    """Copy an attachment into the spool in chunks and return its sha256, git blob sha and size.
+
+    ``source`` is a local path, which is moved, or an uploaded file (any
+    object with ``getbuffer()`` or ``read()``), which is written straight
+    from its buffer, hashing the bytes on the way. The digests are handed
+    to the store when the submission is saved, so it doesn't hash the
+    attachment again.
+    """
+    if isinstance(source, str):
+        shutil.move(source, destination)
+        digest, git_sha = attachment_store.hash_file(destination)
+    elif hasattr(source, 'getbuffer'):
+        # Slices of a memoryview don't copy the upload
+        with open(destination, 'wb') as f, source.getbuffer() as view:
+            sha256, git_sha = attachment_store.new_hashes(len(view))
+            for start in range(0, len(view), CHUNK_SIZE):
+                chunk = view[start:start + CHUNK_SIZE]
+                sha256.update(chunk)
+                git_sha.update(chunk)
+                f.write(chunk)
+        digest, git_sha = sha256.hexdigest(), git_sha.hexdigest()
+    else:
+        with open(destination, 'wb') as f:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                f.write(chunk)
+        # The git blob sha starts with the size, which isn't known before reading
+        digest, git_sha = attachment_store.hash_file(destination)
+    _fsync(destination)
+    return {'sha256': digest, 'git_sha': git_sha, 'size': os.path.getsize(destination)}
+
+
+def pending():
+    """Return the tickets waiting to be saved, oldest first."""
+    if not os.path.isdir(SPOOL_DIR):
+        return []
+    return sorted(name for name in os.listdir(SPOOL_DIR)
+                  if not name.endswith((STAGING_SUFFIX, DONE_SUFFIX)) and os.path.isdir(os.path.join(SPOOL_DIR, name)))
+
+
+def enqueue(request, progress=None):
+    """Spool a submission and return its ticket once it is safely on disk.
+
+    The attachments listed in the request are local paths, which are moved
+    into the spool, or uploaded files, which are written there directly.
+    ``progress(spooled, total)`` is called after each attachment.
+    """
+    with telemetry.span("submission.spool"):
+        ticket = _spool(request, progress)
+    start_writer()
+    if len(pending()) >= BATCH_SIZE:
+        _wake.set()
+    return ticket
+
+
+def _spool(request, progress):
+    total = len(request['images']) + len(request['file'])
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    ticket = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+    staging = os.path.join(SPOOL_DIR, ticket + STAGING_SUFFIX)
+    os.makedirs(staging)
+
+    request = dict(request)
+    digests = {}
+    for key in ('images', 'file'):
+        spooled_paths = []
+        for i, source in enumerate(request[key]):
+            # One directory per attachment keeps the original name even if two are called the same
+            name = os.path.basename(source if isinstance(source, str) else source.name)
+            spooled_path = os.path.join(key, str(i), name)
+            os.makedirs(os.path.join(staging, key, str(i)))
+            digests[spooled_path] = _spool_attachment(source, os.path.join(staging, spooled_path))
+            spooled_paths.append(spooled_path)
+            if progress:
+                progress(len(digests), total)
+        request[key] = spooled_paths
+
+    with open(os.path.join(staging, DIGESTS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(digests, f)
+
+    with open(os.path.join(staging, REQUEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(request, f)
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync(staging)
+
+    # Renaming the directory is atomic, so the writer never sees half a submission
+    os.rename(staging, os.path.join(SPOOL_DIR, ticket))
+    _fsync(SPOOL_DIR)
+    return ticket
+
+
+def _load(ticket):
+    directory = os.path.join(SPOOL_DIR, ticket)
+    with open(os.path.join(directory, REQUEST_FILE), encoding='utf-8') as f:
+        request = json.load(f)
+    for key in ('images', 'file'):
+        request[key] = [os.path.join(directory, path) for path in request[key]]
+    return request
+
+
+def _load_digests(ticket, request):
+    """Return ``{local_path: (sha256, git blob sha)}`` of the attachments of ``request`` hashed while spooling.
+
+    Images are left out, the pipeline rewrites them before they are saved.
+    """
+    directory = os.path.join(SPOOL_DIR, ticket)
+    try:
+        with open(os.path.join(directory, DIGESTS_FILE), encoding='utf-8') as f:
+            digests = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {os.path.join(directory, path): (digest['sha256'], digest['git_sha'])
+            for path, digest in digests.items()
+            if 'git_sha' in digest and os.path.join(directory, path) in request['file']}
+
+
+def _attempts(directory):
+    try:
+        with open(os.path.join(directory, ATTEMPTS_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'attempts': 0, 'retry_at': 0, 'failed': {}}
+
+
+def _record_failure(ticket, failed, give_up=False):
+    """Count a failed save of ``ticket`` and back off its next one.
+
+    It is set aside after ``MAX_ATTEMPTS``, or right away with ``give_up``.
+    """
+    directory = os.path.join(SPOOL_DIR, ticket)
+    attempts = _attempts(directory)['attempts'] + 1
+    with open(os.path.join(directory, ATTEMPTS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'attempts': attempts, 'retry_at': time.time() + FLUSH_INTERVAL * 2 ** attempts, 'failed': failed}, f)
+    telemetry.count("submissions_failed")
+    if give_up or attempts >= MAX_ATTEMPTS:
+        os.makedirs(FAILED_DIR, exist_ok=True)
+        os.rename(directory, os.path.join(FAILED_DIR, ticket))
+        print(f"Failed to save submission {ticket} {attempts} times, moved it to {FAILED_DIR}")
+
+
+def status(ticket):
+    """Return how far saving a submission got: ``saved``, and while it isn't,
+    how many of its ``total`` attachments were ``uploaded`` and which ``failed``
+    (``{name: error}``) on the last attempt. ``given_up`` tells it failed
+    ``MAX_ATTEMPTS`` times and was set aside.
+    """
+    current = dict(_status.get(ticket, {'total': None, 'uploaded': 0, 'failed': {}}))
+    spooled = os.path.join(SPOOL_DIR, ticket)
+    set_aside = os.path.join(FAILED_DIR, ticket)
+    current['given_up'] = os.path.isdir(set_aside)
+    current['saved'] = not current['given_up'] and not os.path.isdir(spooled)
+    if not current['failed'] and not current['saved']:
+        current['failed'] = _attempts(set_aside if current['given_up'] else spooled)['failed']
+    return current
+
+
+def _optimize(tickets):
+    unoptimized = [ticket for ticket in tickets
+                   if not os.path.exists(os.path.join(SPOOL_DIR, ticket, OPTIMIZED_FILE))]
+    if not unoptimized:
+        return
+    import image_pipeline  # Pillow is only needed once there are images to process
+    with telemetry.span("submission.optimize_images"):
+        image_pipeline.optimize_images([path for ticket in unoptimized for path in _load(ticket)['images']])
+    for ticket in unoptimized:
+        open(os.path.join(SPOOL_DIR, ticket, OPTIMIZED_FILE), 'w').close()
+
+
+def _save(tickets):
+    # Loaded for every attempt, the store rewrites the attachment paths of the requests it is given
+    requests = [_load(ticket) for ticket in tickets]
+    digests = {}
+    owners = {}
+    for ticket, request in zip(tickets, requests):
+        digests.update(_load_digests(ticket, request))
+        owners.update((path, ticket) for path in request['images'] + request['file'])
+        _status[ticket] = {'total': len(request['images']) + len(request['file']), 'uploaded': 0, 'failed': {}}
+
+    def progress(local_path, error):
+        ticket_status = _status.get(owners.get(local_path))
+        if ticket_status is None:
+            # Thumbnails and other derived files aren't counted
+            return
+        if error is None:
+            ticket_status['uploaded'] += 1
+        else:
+            ticket_status['failed'][os.path.basename(local_path)] = error
+
+    with telemetry.span("submission.save"):
+        get_store().create_requests(requests, progress, digests)
+
+
+@contextmanager
+def _spool_lock():
+    """Hold the spool while flushing it.
+
+    The form and the dashboard run as separate processes sharing the spool,
+    and both may run a writer; only one of them may take the pending
+    submissions at a time.
+    """
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    with _flush_lock, open(os.path.join(SPOOL_DIR, LOCK_FILE), 'a+b') as f:
+        if os.name == "posix":
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            # Retried for 10 seconds, then raises and the writer tries again on its next round
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if os.name == "posix":
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def flush(limit=BATCH_SIZE):
+    """Save up to ``limit`` pending submissions at once and return how many were saved.
+
+    Submissions whose attachments fail to upload don't hold back the rest
+    of the batch, which is saved again without them right away.
+    """
+    with _spool_lock():
+        now = time.time()
+        _remove_saved()
+        tickets = [ticket for ticket in pending()
+                   if _attempts(os.path.join(SPOOL_DIR, ticket))['retry_at'] <= now][:limit]
+        tickets = [ticket for ticket in tickets if _readable(ticket)]
+        if not tickets:
+            return 0
+
+        _optimize(tickets)
+        while True:
+            try:
+                _save(tickets)
+                break
+            except Exception:
+                failed = [ticket for ticket in tickets if _status.get(ticket, {}).get('failed')]
+                for ticket in failed:
+                    _record_failure(ticket, _status[ticket]['failed'])
+                if not failed or len(failed) == len(tickets):
+                    raise
+                tickets = [ticket for ticket in tickets if ticket not in failed]
+        telemetry.count("submissions_saved", len(tickets))
+
+        for ticket in tickets:
+            # Out of the spool at once; a delete cut short would leave half a submission in it
+            os.rename(os.path.join(SPOOL_DIR, ticket), os.path.join(SPOOL_DIR, ticket + DONE_SUFFIX))
+            _status.pop(ticket, None)
+        _remove_saved()
+        return len(tickets)
+
+
+def _readable(ticket):
+    """Whether the request of ``ticket`` can be loaded; if it can't, the ticket is set aside."""
+    try:
+        _load(ticket)
+        return True
+    except (OSError, ValueError) as e:
+        print(f"Can't read submission {ticket}: {str(e)}")
+        _record_failure(ticket, {REQUEST_FILE: str(e)}, give_up=True)
+        return False
+
+
+def _remove_saved():
+    """Delete the saved submissions, including those an earlier process didn't get to delete."""
+    for name in os.listdir(SPOOL_DIR) if os.path.isdir(SPOOL_DIR) else []:
+        if name.endswith(DONE_SUFFIX):
+            shutil.rmtree(os.path.join(SPOOL_DIR, name), ignore_errors=True)
+
+
+def retry_failed():
+    """Queue the submissions set aside in ``FAILED_DIR`` again and return how many there were."""
+    if not os.path.isdir(FAILED_DIR):
+        return 0
+    tickets = os.listdir(FAILED_DIR)
+    for ticket in tickets:
+        attempts = os.path.join(FAILED_DIR, ticket, ATTEMPTS_FILE)
+        if os.path.exists(attempts):
+            os.remove(attempts)
+        os.rename(os.path.join(FAILED_DIR, ticket), os.path.join(SPOOL_DIR, ticket))
+    return len(tickets)
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            # Keep going while full batches are waiting
+            with background():
+                while flush() == BATCH_SIZE:
+                    pass
+        except Exception as e:
+            print(f"Failed to save spooled submissions, will retry: {str(e)}")
+
+
+def start_writer():
+    """Start the background writer of this process if it is not running yet."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name="submission-writer", daemon=True)
+            _writer.start()
+
+
+if __name__ == "__main__":
+    if "--retry-failed" in sys.argv[1:]:
+        print(f"Queued {retry_failed()} submissions again")
+    while flush():
+        pass
@@ -0,0 +1,148 @@
+"""Timings and counters of what the apps spend their time on.
+
+Stages of a submission, of loading the data and of every GitHub call are
+wrapped in ``span``, which records how long they took and whether they
+failed; ``count`` adds to counters such as calls, bytes and retries. The
+last ``WINDOW`` timings of every span are kept for percentiles. Everything
+lives in memory, per process, and can be read by the dashboard or exported
+in the Prometheus text format, also over HTTP when ``metrics_port`` is set.
+"""
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+
+WINDOW = 1000  # Timings kept per span for the percentiles
+METRICS_PORT = int(st.secrets.get("metrics_port", 0))  # Port serving /metrics, 0 disables it
+PREFIX = "fbio_"  # Prefix of the exported metric names
+
+_lock = threading.Lock()
+_spans = {}  # name -> {'timings': deque of seconds, 'count', 'errors', 'total'}
+_counters = {}  # name -> value
+_exporter = None
+
+
+@contextmanager
+def span(name):
+    """Time the block as one occurrence of ``name``; an exception counts it as an error."""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            stats = _spans.get(name)
+            if stats is None:
+                stats = _spans[name] = {'timings': deque(maxlen=WINDOW), 'count': 0, 'errors': 0, 'total': 0.0}
+            stats['timings'].append(elapsed)
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['errors'] += failed
+
+
+def count(name, value=1):
+    """Add ``value`` to the counter ``name``."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def spans():
+    """Return ``{name: {'count', 'errors', 'p50', 'p95', 'max'}}``, in seconds over the last ``WINDOW`` timings."""
+    with _lock:
+        snapshot = {name: (sorted(stats['timings']), stats['count'], stats['errors'])
+                    for name, stats in _spans.items()}
+    return {name: {'count': calls, 'errors': errors, 'p50': _percentile(ordered, 0.5),
+                   'p95': _percentile(ordered, 0.95), 'max': ordered[-1]}
+            for name, (ordered, calls, errors) in sorted(snapshot.items())}
+
+
+def counters():
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def _metric(name):
+    return PREFIX + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus():
+    """Return every span and counter in the Prometheus text exposition format."""
+    with _lock:
+        snapshot = {name: (sorted(stats['timings']), stats['count'], stats['errors'], stats['total'])
+                    for name, stats in _spans.items()}
+        counter_values = dict(_counters)
+
+    lines = [f"# TYPE {PREFIX}span_seconds summary"]
+    for name, (ordered, calls, errors, total) in sorted(snapshot.items()):
+        for quantile in (0.5, 0.95):
+            lines.append(f'{PREFIX}span_seconds{{span="{name}",quantile="{quantile}"}} {_percentile(ordered, quantile)}')
+        lines.append(f'{PREFIX}span_seconds_sum{{span="{name}"}} {total}')
+        lines.append(f'{PREFIX}span_seconds_count{{span="{name}"}} {calls}')
+    lines.append(f"# TYPE {PREFIX}span_errors_total counter")
+    for name, (_, _, errors, _) in sorted(snapshot.items()):
+        lines.append(f'{PREFIX}span_errors_total{{span="{name}"}} {errors}')
+    for name, value in sorted(counter_values.items()):
+        lines.append(f"# TYPE {_metric(name)}_total counter")
+        lines.append(f"{_metric(name)}_total {value}")
+    for name, value in _gauges().items():
+        lines.append(f"# TYPE {_metric(name)} gauge")
+        lines.append(f"{_metric(name)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _gauges():
+    """Current values worth exporting alongside the counters, such as the rate limit headroom."""
+    gauges = {}
+    github_client = sys.modules.get("github_client")
+    if github_client is not None:
+        rate = github_client.scheduler.stats()
+        if rate['remaining'] is not None:
+            gauges['github_rate_limit_remaining'] = rate['remaining']
+            gauges['github_rate_limit_limit'] = rate['limit']
+        gauges['github_throttled'] = rate['throttled']
+        gauges['github_rate_limit_waits'] = rate['waits']
+    return gauges
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_exporter():
+    """Serve ``/metrics`` on ``METRICS_PORT`` from this process if it is set and not served yet."""
+    global _exporter
+    with _lock:
+        if not METRICS_PORT or _exporter is not None:
+            return
+        try:
+            _exporter = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            # Both apps may run in one process, or another one already serves the port
+            print(f"Not serving metrics on port {METRICS_PORT}: {str(e)}")
+            _exporter = False
+            return
+    threading.Thread(target=_exporter.serve_forever, name="metrics-exporter", daemon=True).start()